@@ -1,4 +1,6 @@
 from data_storage import medicines, users, orders, cart, save_data
+from catalog_io import import_catalog, export_catalog, guess_format
+from order_archive import order_archive
 
 def admin_menu():
     while True:
@@ -8,7 +10,9 @@ def admin_menu():
         print("3. View Orders")
         print("4. Update Order Status")
         print("5. View Medicine Stock")
-        print("6. Logout")
+        print("6. Import Catalog (CSV/JSONL)")
+        print("7. Export Catalog (CSV/JSONL)")
+        print("8. Logout")
         choice = input("Enter choice: ")
         if choice == "1":
             med_name = input("Enter medicine name: ")
@@ -45,14 +49,17 @@ def admin_menu():
                 print(f"Order ID: {oid}, User: {order['username']}, Items: {order['items']}, Status: {order['status']}")
         elif choice == "4":
             order_id = input("Enter order ID: ")
-            if order_id in orders:
+            if order_id in orders or order_archive.get(order_id) is not None:
                 status = input("Enter new status (Processing/Shipped/Delivered): ")
-                if status in ["Processing", "Shipped", "Delivered"]:
+                # Checked first, so an invalid status leaves an archived order where it is
+                if status not in ["Processing", "Shipped", "Delivered"]:
+                    print("Invalid status!")
+                elif order_id in orders or order_archive.restore(order_id) is not None:
                     orders[order_id]["status"] = status
                     save_data(medicines, users, orders, cart)
                     print("Status updated!")
                 else:
-                    print("Invalid status!")
+                    print("Order not found!")
             else:
                 print("Order not found!")
         elif choice == "5":
@@ -63,6 +70,35 @@ def admin_menu():
                 for med, details in medicines.items():
                     print(f"Medicine: {med}, Price: ₹{details['price']}, Stock: {details['stock']}")
         elif choice == "6":
+            path = input("Enter file path (.csv or .jsonl): ").strip()
+            fmt = guess_format(path)
+            if fmt is None:
+                print("File name must end in .csv or .jsonl!")
+                continue
+            try:
+                with open(path, encoding="utf-8-sig", newline="") as f:
+                    report = import_catalog(f, fmt)
+            except (OSError, ValueError) as e:
+                print(f"Import failed: {e}")
+                continue
+            for error in report["errors"]:
+                print(f"Line {error['line']}: {error['error']}")
+            print(f"{report['imported']} of {report['rows']} rows imported, {report['error_count']} error(s).")
+        elif choice == "7":
+            path = input("Enter file path (.csv or .jsonl): ").strip()
+            fmt = guess_format(path)
+            if fmt is None:
+                print("File name must end in .csv or .jsonl!")
+                continue
+            try:
+                with open(path, "w", encoding="utf-8", newline="") as f:
+                    for chunk in export_catalog(fmt):
+                        f.write(chunk)
+            except OSError as e:
+                print(f"Export failed: {e}")
+                continue
+            print(f"Catalog exported to {path}")
+        elif choice == "8":
             break
         else:
             print("Invalid choice!")
\ No newline at end of file
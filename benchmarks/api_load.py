@@ -0,0 +1,345 @@
+"""Load-test the Flask API against a synthetic database and report latency.
+
+Seeds a throw-away database (see seed.py), then drives each endpoint in turn
+from ``--threads`` concurrent clients, each with its own Flask test client
+and session. Prescription extraction talks to a fake model that answers
+after ``--model-latency`` seconds, so no API key or network is needed.
+Afterwards ``--mix`` runs all endpoints together in a weighted mix.
+
+For every endpoint it prints requests, errors, throughput and p50/p95/p99
+latency. --json saves the results (with the settings and git revision) and
+--compare prints the change against an earlier saved run:
+
+    python benchmarks/api_load.py --medicines 100000 --users 50000 --orders 1000000 --json base.json
+    python benchmarks/api_load.py --medicines 100000 --users 50000 --orders 1000000 --compare base.json
+
+Seeding a million orders takes a while; --db keeps the database at a path
+and reuses it on the next run (runs then also see earlier runs' writes).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from seed import seed_database, medicine_name, username, PASSWORD, STATUSES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Relative weights for --mix, roughly a browsing-heavy day
+MIX = {"medicines": 10, "search": 20, "index": 5, "login": 5, "register": 1, "extract_medicines": 3,
+       "add_to_cart": 10, "get_cart": 10, "update_cart": 3, "cart_batch": 2, "place_order": 3, "get_orders": 8,
+       "admin_orders": 2, "admin_update_order": 1}
+
+
+class FakeModel:
+    """Stands in for Gemini: replies after ``latency`` seconds with the allowed names found in the OCR text."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, parts):
+        self.calls += 1
+        time.sleep(self.latency)
+        allowed, _, text = parts[-1].partition("\n\nocr_text = ")
+        allowed = json.loads(allowed[len("allowed_medicines = "):])
+        text = text.lower()
+        return SimpleNamespace(text=json.dumps([name for name in allowed if name.lower() in text]))
+
+
+class Worker:
+    """One simulated client: a test client with its own cookies, plus an admin session on demand."""
+
+    def __init__(self, app, n, sizes):
+        self.app = app
+        self.n = n
+        self.sizes = sizes
+        self.rng = random.Random(n)
+        self.client = app.test_client()
+        self.count = 0
+        self._admin = None
+
+    @property
+    def admin(self):
+        if self._admin is None:
+            self._admin = self.app.test_client()
+            self._admin.post("/admin_login", json={"username": "admin", "password": "admin123"})
+        return self._admin
+
+    def medicine(self):
+        return medicine_name(self.rng.randrange(self.sizes["medicines"]))
+
+    def user(self):
+        return username(self.rng.randrange(self.sizes["users"]))
+
+    def cart_user(self):
+        # Each worker has its own carts so cart state doesn't depend on thread timing
+        return f"bench-{self.n}-{self.rng.randrange(50)}"
+
+    def unique(self, prefix):
+        self.count += 1
+        return f"{prefix}-{os.getpid()}-{self.n}-{self.count}"
+
+
+# Each scenario does its untimed setup and returns the timed request as a thunk
+
+def s_login(w):
+    return lambda: w.client.post("/login", json={"username": w.user(), "password": PASSWORD})
+
+
+def s_register(w):
+    return lambda: w.client.post("/register", json={"username": w.unique("reg"), "password": PASSWORD,
+                                                    "address": "1 Bench Road"})
+
+
+def s_index(w):
+    return lambda: w.client.get("/")
+
+
+def s_medicines(w):
+    return lambda: w.client.get("/medicines", headers={"Accept-Encoding": "gzip"})
+
+
+def s_search(w):
+    query = f"medicine {w.rng.randrange(1000):03d}"
+    return lambda: w.client.get("/search", query_string={"q": query})
+
+
+def s_extract_medicines(w):
+    text = (f"Rx #{w.rng.randrange(10 ** 9)}\nTab {w.medicine()} 500mg 1-0-1\n"
+            f"Syp {w.medicine()} 5ml at night\nReview after 5 days")
+    return lambda: w.client.post("/extract_medicines", json={"text": text})
+
+
+def s_add_to_cart(w):
+    body = {"username": w.cart_user(), "medicine": w.medicine(), "quantity": 1}
+    return lambda: w.client.post("/add_to_cart", json=body)
+
+
+def s_get_cart(w):
+    user = w.cart_user()
+    return lambda: w.client.get("/get_cart", query_string={"username": user})
+
+
+def s_update_cart(w):
+    body = {"username": w.cart_user(), "medicine": w.medicine(), "quantity": w.rng.randint(1, 3)}
+    return lambda: w.client.post("/update_cart", json=body)
+
+
+def s_cart_batch(w):
+    body = {"username": w.cart_user(), "operations": [{"op": "add", "medicine": w.medicine(), "quantity": 1}
+                                                      for _ in range(3)]}
+    return lambda: w.client.post("/cart/batch", json=body)
+
+
+def s_place_order(w):
+    user = w.unique("order")
+    for _ in range(2):
+        w.client.post("/add_to_cart", json={"username": user, "medicine": w.medicine(), "quantity": 1})
+    return lambda: w.client.post("/place_order", json={"username": user, "prescription": "benchmark"})
+
+
+def s_get_orders(w):
+    user = w.user()
+    return lambda: w.client.get("/get_orders", query_string={"username": user})
+
+
+def s_admin_orders(w):
+    admin = w.admin
+    status = w.rng.choice(STATUSES)
+    return lambda: admin.get("/admin_orders", query_string={"status": status, "limit": 50})
+
+
+def s_admin_update_order(w):
+    admin = w.admin
+    body = {"order_id": f"o{w.rng.randrange(max(w.sizes['orders'], 1)):07d}", "status": w.rng.choice(STATUSES)}
+    return lambda: admin.post("/admin_update_order", json=body)
+
+
+SCENARIOS = {name[2:]: func for name, func in globals().items() if name.startswith("s_")}
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def failed(response):
+    if response.status_code >= 400:
+        return True
+    body = response.get_json(silent=True)
+    return isinstance(body, dict) and body.get("success") is False
+
+
+def run_phase(workers, names, weights, requests):
+    """Spread ``requests`` over the workers; returns (elapsed seconds, {name: [latencies]}, {name: errors})."""
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    start = threading.Barrier(len(workers) + 1)
+
+    def drive(worker, share):
+        mine = {name: [] for name in names}
+        failures = {name: 0 for name in names}
+        start.wait()
+        for _ in range(share):
+            name = worker.rng.choices(names, weights)[0] if len(names) > 1 else names[0]
+            request = SCENARIOS[name](worker)
+            t = time.perf_counter()
+            response = request()
+            mine[name].append(time.perf_counter() - t)
+            failures[name] += failed(response)
+        with lock:
+            for name in names:
+                latencies[name].extend(mine[name])
+                errors[name] += failures[name]
+
+    shares = [requests // len(workers) + (i < requests % len(workers)) for i in range(len(workers))]
+    threads = [threading.Thread(target=drive, args=(w, share)) for w, share in zip(workers, shares)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, latencies, errors
+
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3)  # noqa: E731
+    return {"requests": len(ordered), "errors": errors,
+            "throughput_rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+            "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+            "p50_ms": ms(percentile(ordered, 50)), "p95_ms": ms(percentile(ordered, 95)),
+            "p99_ms": ms(percentile(ordered, 99)), "max_ms": ms(ordered[-1]) if ordered else 0.0}
+
+
+def print_table(title, endpoints):
+    print(f"\n{title}")
+    print(f"{'endpoint':20} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, s in endpoints.items():
+        print(f"{name:20} {s['requests']:8} {s['errors']:6} {s['throughput_rps']:9.1f} "
+              f"{s['p50_ms']:9.2f} {s['p95_ms']:9.2f} {s['p99_ms']:9.2f}")
+
+
+def print_comparison(baseline, result):
+    def change(old, new):
+        return f"{(new - old) / old * 100:+7.1f}%" if old else "    n/a"
+
+    print(f"\nchange against {baseline.get('git_revision') or 'baseline'} ({baseline.get('timestamp', '?')})")
+    print(f"{'endpoint':20} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for section in ("endpoints", "mix"):
+        old_endpoints = (baseline.get(section) or {}).get("endpoints", baseline.get(section) or {})
+        new_endpoints = (result.get(section) or {}).get("endpoints", result.get(section) or {})
+        for name, new in new_endpoints.items():
+            old = old_endpoints.get(name)
+            if not old:
+                continue
+            label = name if section == "endpoints" else f"mix:{name}"
+            print(f"{label:20} {change(old['throughput_rps'], new['throughput_rps'])} "
+                  f"{change(old['p50_ms'], new['p50_ms'])} {change(old['p95_ms'], new['p95_ms'])} "
+                  f"{change(old['p99_ms'], new['p99_ms'])}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--medicines", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=400, help="timed requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed requests per endpoint first")
+    parser.add_argument("--endpoints", help=f"comma-separated subset of: {','.join(SCENARIOS)}")
+    parser.add_argument("--mix", type=int, default=0, help="also run this many requests as a weighted mix")
+    parser.add_argument("--model-latency", type=float, default=0.05, help="fake model reply time in seconds")
+    parser.add_argument("--db", help="database path to seed on first use and reuse afterwards")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    names = args.endpoints.split(",") if args.endpoints else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown endpoint(s): {', '.join(unknown)}")
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="api-load-"), "delivery.db")
+    seed_seconds = None
+    if not os.path.exists(path):
+        print(f"seeding {path} ...", flush=True)
+        seed_seconds = seed_database(path, args.medicines, args.users, args.orders, stock=10 ** 9)
+    conn = sqlite3.connect(path)
+    sizes = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+             for table in ("medicines", "users", "orders")}
+    conn.close()
+    # Scenarios pick synthetic names by index, so only count what seed.py generated
+    sizes = {"medicines": min(sizes["medicines"], args.medicines), "users": min(sizes["users"], args.users),
+             "orders": min(sizes["orders"], args.orders)}
+
+    os.environ.update(DB_NAME=path, JOB_AUTOSTART="0", WRITE_BEHIND_INTERVAL="0",
+                      DB_POOL_SIZE=str(max(args.threads, int(os.getenv("DB_POOL_SIZE", "0")))))
+    os.environ.pop("api_key", None)
+    sys.path.insert(0, ROOT)
+    import data_storage
+    import extraction
+    from server import app
+
+    t = time.perf_counter()
+    data_storage.init()
+    init_seconds = time.perf_counter() - t
+    model = FakeModel(args.model_latency)
+    extraction.set_model(model)
+    workers = [Worker(app, n, sizes) for n in range(args.threads)]
+
+    result = {"timestamp": datetime.now().isoformat(timespec="seconds"), "git_revision": git_revision(),
+              "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "cpus": os.cpu_count(),
+              "settings": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+              "database": dict(sizes, path=path), "seed_seconds": seed_seconds,
+              "init_ms": round(init_seconds * 1000, 2), "endpoints": {}}
+    for name in names:
+        if args.warmup:
+            run_phase(workers, [name], None, args.warmup)
+        elapsed, latencies, errors = run_phase(workers, [name], None, args.requests)
+        result["endpoints"][name] = summarize(latencies[name], errors[name], elapsed)
+    print_table(f"{args.threads} clients, {args.requests} requests per endpoint", result["endpoints"])
+
+    if args.mix:
+        weights = [MIX.get(name, 1) for name in names]
+        elapsed, latencies, errors = run_phase(workers, names, weights, args.mix)
+        result["mix"] = {"requests": args.mix, "throughput_rps": round(args.mix / elapsed, 1),
+                         "endpoints": {name: summarize(latencies[name], errors[name], elapsed)
+                                       for name in names if latencies[name]}}
+        print_table(f"mixed load: {args.mix} requests, {result['mix']['throughput_rps']} req/s overall",
+                    result["mix"]["endpoints"])
+    result["model_calls"] = model.calls
+    result["extraction"] = extraction.extraction_stats()
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Check the extraction deadline and circuit breaker against fake models.
+
+Drives extraction.run_extraction() through set_model() with models that
+answer, hang past the deadline or fail, and checks the result source, the
+breaker state and the upstream call count at each step: the deadline
+returns the local answer in time, failures open the breaker, a half-open
+probe closes it again, a probe abandoned before the model call (prompt
+building failed) doesn't leave it stuck half-open, and concurrent calls
+are all counted. Exits non-zero on any failure.
+
+    python benchmarks/extraction_breaker.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESET = 0.2
+FAILURES = 3
+
+
+class Model:
+    """Answers with ``reply`` after ``latency`` seconds, or raises when ``fail`` is set."""
+
+    def __init__(self, reply='["Paracetamol"]', latency=0.0, fail=False):
+        self.reply = reply
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, parts):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("upstream unavailable")
+        return SimpleNamespace(text=self.reply)
+
+
+def main():
+    os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="extraction-breaker-"), "breaker.db")
+    os.environ["EXTRACT_BREAKER_FAILURES"] = str(FAILURES)
+    os.environ["EXTRACT_BREAKER_RESET"] = str(RESET)
+    sys.path.insert(0, ROOT)
+    import extraction
+    from data_storage import init
+
+    init()
+    failures = []
+
+    def check(name, ok, detail=""):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{f' ({detail})' if detail and not ok else ''}")
+        if not ok:
+            failures.append(name)
+
+    text = "Take paracetamol 500mg twice daily"
+    breaker = extraction._breaker
+
+    model = Model()
+    extraction.set_model(model)
+    result = extraction.run_extraction(text, deadline=2.0)
+    check("answer within the deadline comes from the model", result["source"] == "gemini", result)
+
+    extraction.set_model(Model(latency=1.0))
+    started = time.monotonic()
+    result = extraction.run_extraction(text, deadline=0.1)
+    elapsed = time.monotonic() - started
+    check("slow model: local answer once the deadline passes",
+          result["source"] == "error_fallback" and "deadline" in result.get("error", "") and elapsed < 0.5,
+          f"{result}, {elapsed:.2f}s")
+    check("...and the local matcher found the medicine", "Paracetamol" in result["detected"], result)
+    extraction.set_model(Model())
+    extraction.run_extraction(text, deadline=2.0)  # a success resets the failure count
+
+    failing = Model(fail=True)
+    extraction.set_model(failing)
+    for _ in range(FAILURES):
+        extraction.run_extraction(text, deadline=2.0)
+    check("consecutive failures open the breaker", breaker.stats()["state"] == "open", breaker.stats())
+    calls = failing.calls
+    result = extraction.run_extraction(text, deadline=2.0)
+    check("open breaker skips the model", result.get("error") == "circuit_open" and failing.calls == calls, result)
+
+    time.sleep(RESET + 0.05)
+    extraction.run_extraction(text, deadline=2.0)
+    check("failed half-open probe re-opens the breaker", breaker.stats()["state"] == "open", breaker.stats())
+
+    time.sleep(RESET + 0.05)
+    real_allowed = extraction.allowed_medicines
+
+    def broken(text):
+        raise RuntimeError("catalog unavailable")
+
+    extraction.set_model(Model())
+    extraction.allowed_medicines = broken
+    try:
+        result = extraction.run_extraction(text, deadline=2.0)
+    finally:
+        extraction.allowed_medicines = real_allowed
+    check("prompt failure during the probe falls back", result["source"] == "error_fallback", result)
+    result = extraction.run_extraction(text, deadline=2.0)
+    check("...and releases the probe, so the next call gets through", result["source"] == "gemini", result)
+    check("successful probe closes the breaker", breaker.stats()["state"] == "closed", breaker.stats())
+
+    model = Model(latency=0.001)
+    extraction.set_model(model)
+    before = extraction.extraction_stats()["upstream_calls"]
+    threads = [threading.Thread(target=lambda: [extraction.run_extraction(text, deadline=5.0) for _ in range(50)])
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counted = extraction.extraction_stats()["upstream_calls"] - before
+    check("concurrent upstream calls are all counted", counted == model.calls == 400,
+          f"counted {counted}, model saw {model.calls}")
+
+    extraction.set_model(None)
+    print(f"{len(failures)} failure(s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
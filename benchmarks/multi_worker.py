@@ -0,0 +1,134 @@
+"""Run several server processes against one database and check they agree.
+
+Mimics ``gunicorn --preload``: the app is imported once, then worker
+processes are forked and each serves requests through its own Flask test
+client. Writes made through one worker (catalog edits, carts, orders,
+registrations, stock) must be visible through every other worker on the
+next request. A final phase places orders from all workers at once and
+checks that each worker reports the same stock as the database.
+
+    python benchmarks/multi_worker.py --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def serve(conn):
+    from server import app
+    client = app.test_client()
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        method, path, body = message
+        response = client.open(path, method=method, json=body)
+        conn.send((response.status_code, response.get_json(silent=True)))
+
+
+class Worker:
+    def __init__(self, ctx):
+        self._conn, child = ctx.Pipe()
+        self._lock = threading.Lock()
+        self.process = ctx.Process(target=serve, args=(child,), daemon=True)
+        self.process.start()
+
+    def call(self, method, path, body=None):
+        with self._lock:
+            self._conn.send((method, path, body))
+            return self._conn.recv()[1]
+
+    def stop(self):
+        self._conn.send(None)
+        self.process.join(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--orders", type=int, default=20, help="concurrent orders per worker in the last phase")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="multi-worker-"), "delivery.db")
+    os.environ.update(DB_NAME=path, JOB_AUTOSTART="0", WRITE_BEHIND_INTERVAL="0")
+    os.environ.pop("api_key", None)
+    sys.path.insert(0, ROOT)
+    import server  # noqa: F401  (preload, like gunicorn --preload)
+    from data_storage import init
+    init()  # what gunicorn.conf.py's on_starting hook does
+
+    ctx = multiprocessing.get_context("fork")
+    workers = [Worker(ctx) for _ in range(max(args.workers, 3))]
+    a, b, c = workers[:3]
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    for worker in workers:
+        worker.call("POST", "/admin_login", {"username": "admin", "password": "admin123"})
+
+    a.call("POST", "/admin_add_medicine", {"name": "Zincovit", "price": 12, "stock": 40})
+    check("medicine added on one worker is listed by another", "Zincovit" in b.call("GET", "/medicines"))
+    check("...and found by its search index", any(r["name"] == "Zincovit"
+                                                  for r in c.call("GET", "/search?q=zinc")["results"]))
+
+    b.call("POST", "/register", {"username": "pat", "password": "secret1", "address": "1 Road"})
+    check("user registered on one worker can log in on another",
+          c.call("POST", "/login", {"username": "pat", "password": "secret1"})["success"])
+
+    a.call("POST", "/add_to_cart", {"username": "pat", "medicine": "Zincovit", "quantity": 3})
+    check("cart written by one worker is read by another",
+          b.call("GET", "/get_cart?username=pat")["cart"] == {"Zincovit": 3})
+    check("held stock is visible everywhere", c.call("GET", "/medicines")["Zincovit"]["stock"] == 37)
+
+    placed = b.call("POST", "/place_order", {"username": "pat", "prescription": "dr who"})
+    check("order placed from a cart filled elsewhere", placed["success"])
+    order_id = placed["order_id"]
+    check("new order listed by another worker",
+          any(o["order_id"] == order_id for o in c.call("GET", "/get_orders?username=pat")["orders"]))
+    c.call("GET", "/get_orders?username=pat")  # warm c's order cache before the update
+    a.call("POST", "/admin_update_order", {"order_id": order_id, "status": "Shipped"})
+    statuses = {o["order_id"]: o["status"] for o in c.call("GET", "/get_orders?username=pat")["orders"]}
+    check("status change on one worker reaches another's cached order", statuses.get(order_id) == "Shipped")
+
+    c.call("POST", "/admin_login", {"username": "admin", "password": "admin123"})  # c logged in as pat above
+    c.call("POST", "/admin_remove_medicine", {"name": "Zincovit"})
+    check("removed medicine disappears from other workers", "Zincovit" not in a.call("GET", "/medicines"))
+
+    # Everyone orders Paracetamol at once; every worker must then agree with the database
+    def shopper(worker, n):
+        for i in range(args.orders):
+            user = f"load-{n}-{i}"
+            worker.call("POST", "/add_to_cart", {"username": user, "medicine": "Paracetamol", "quantity": 2})
+            worker.call("POST", "/place_order", {"username": user, "prescription": "x"})
+
+    threads = [threading.Thread(target=shopper, args=(worker, n)) for n, worker in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    conn = sqlite3.connect(path)
+    stock = conn.execute("SELECT stock FROM medicines WHERE name = 'Paracetamol'").fetchone()[0]
+    ordered = conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM order_items WHERE medicine = 'Paracetamol'").fetchone()[0]
+    conn.close()
+    check(f"no oversell under concurrent orders (left {stock}, ordered {ordered})", stock >= 0 and stock + ordered == 150)
+    seen = [worker.call("GET", "/medicines")["Paracetamol"]["stock"] for worker in workers]
+    check(f"all workers report the database stock {stock}: {seen}", all(s == stock for s in seen))
+
+    for worker in workers:
+        worker.stop()
+    print(f"{len(failures)} failure(s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
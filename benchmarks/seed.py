@@ -0,0 +1,104 @@
+"""Fill a database with synthetic medicines, users and orders.
+
+The schema is created by ``data_storage.init()`` in a fresh interpreter, so
+the file is exactly what the app would build; rows are then bulk inserted in
+chunks. The same arguments and --seed always produce the same rows.
+
+    python benchmarks/seed.py /tmp/bench.db --medicines 100000 --users 50000 --orders 1000000
+
+Names follow a fixed pattern the load scripts rely on: medicines are
+``Medicine 000042``, users ``user000042`` (password ``secret1``).
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "secret1"
+STATUSES = ("Processing", "Shipped", "Delivered")
+CHUNK = 10000
+
+
+def medicine_name(i):
+    return f"Medicine {i:06d}"
+
+
+def username(i):
+    return f"user{i:06d}"
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed_database(path, medicines, users, orders, stock=100, lines_per_order=2, seed=1):
+    """Create ``path`` with the app's schema plus synthetic rows; returns the seconds taken."""
+    started = time.perf_counter()
+    env = dict(os.environ, DB_NAME=path)
+    subprocess.run([sys.executable, "-c", f"import sys; sys.path.insert(0, {ROOT!r}); "
+                                          "import data_storage; data_storage.init()"], env=env, check=True)
+    rng = random.Random(seed)
+    prices = [round(5 + rng.random() * 495, 2) for _ in range(medicines)]
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    with conn:
+        for chunk in _chunks((medicine_name(i), prices[i], stock) for i in range(medicines)):
+            conn.executemany("INSERT OR IGNORE INTO medicines (name, price, stock) VALUES (?, ?, ?)", chunk)
+        for chunk in _chunks((username(i), PASSWORD, f"{i} Synthetic Street") for i in range(users)):
+            conn.executemany("INSERT OR IGNORE INTO users (username, password, address) VALUES (?, ?, ?)", chunk)
+
+    def order_rows():
+        start = datetime(2024, 1, 1, 18, 0, 0)
+        for i in range(orders):
+            lines = {}
+            for _ in range(lines_per_order if medicines else 0):
+                m = rng.randrange(medicines)
+                lines[m] = lines.get(m, 0) + rng.randint(1, 3)
+            items = {medicine_name(m): qty for m, qty in lines.items()}
+            delivery = (start + timedelta(hours=i * 24 * 365 // max(orders, 1))).strftime('%Y-%m-%d %H:%M:%S')
+            yield ((f"o{i:07d}", username(i % max(users, 1)), json.dumps(items, separators=(",", ":")),
+                    "synthetic", STATUSES[rng.randrange(3)], delivery),
+                   [(f"o{i:07d}", medicine_name(m), qty, prices[m]) for m, qty in lines.items()])
+
+    with conn:
+        for chunk in _chunks(order_rows()):
+            conn.executemany("INSERT OR IGNORE INTO orders (order_id, username, items, prescription, status, "
+                             "delivery_time) VALUES (?, ?, ?, ?, ?, ?)", [order for order, _ in chunk])
+            conn.executemany("INSERT OR IGNORE INTO order_items (order_id, medicine, quantity, unit_price) "
+                             "VALUES (?, ?, ?, ?)", [line for _, lines in chunk for line in lines])
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--medicines", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if os.path.exists(args.path):
+        parser.error(f"{args.path} already exists")
+    seconds = seed_database(args.path, args.medicines, args.users, args.orders, stock=args.stock, seed=args.seed)
+    print(f"seeded {args.path} in {seconds:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
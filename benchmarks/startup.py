@@ -0,0 +1,86 @@
+"""Measure how long the app takes to import and to become ready.
+
+Builds a synthetic database of the requested size, then times fresh
+interpreter runs of:
+
+    import data_storage      (should stay flat as the database grows)
+    import server
+    data_storage.init()      (schema check plus loading catalog and users)
+    first GET /medicines
+
+and checks that importing wrote nothing to the database and did not load the
+Gemini SDK. Prints medians; --json also writes them to a file so runs can be
+compared over time.
+
+    python benchmarks/startup.py --medicines 20000 --users 5000 --orders 50000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from seed import seed_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, sys, time
+sys.path.insert(0, ROOT)
+timings = {}
+t = time.perf_counter(); import data_storage; timings["import_data_storage"] = time.perf_counter() - t
+t = time.perf_counter(); import server; timings["import_server"] = time.perf_counter() - t
+timings["genai_loaded_on_import"] = "google.generativeai" in sys.modules
+if MODE == "full":
+    t = time.perf_counter(); data_storage.init(); timings["init"] = time.perf_counter() - t
+    client = server.app.test_client()
+    t = time.perf_counter(); client.get("/medicines"); timings["first_request"] = time.perf_counter() - t
+print(json.dumps(timings))
+"""
+
+
+def probe(path, mode):
+    env = dict(os.environ, DB_NAME=path, JOB_AUTOSTART="0")
+    env.pop("api_key", None)
+    code = f"ROOT = {ROOT!r}\nMODE = {mode!r}\n" + PROBE
+    out = subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--medicines", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="startup-"), "delivery.db")
+    seed_database(path, args.medicines, args.users, args.orders)
+
+    watcher = sqlite3.connect(path)
+    before = watcher.execute("PRAGMA data_version").fetchone()[0]
+    import_only = probe(path, "import")
+    writes_on_import = watcher.execute("PRAGMA data_version").fetchone()[0] != before
+    watcher.close()
+
+    runs = [probe(path, "full") for _ in range(args.runs)]
+    result = {"medicines": args.medicines, "users": args.users, "orders": args.orders, "runs": args.runs,
+              "writes_on_import": writes_on_import, "genai_loaded_on_import": import_only["genai_loaded_on_import"]}
+    for key in ("import_data_storage", "import_server", "init", "first_request"):
+        result[f"{key}_ms"] = round(statistics.median(run[key] for run in runs) * 1000, 2)
+
+    for key, value in result.items():
+        print(f"{key:28} {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    sys.exit(1 if writes_on_import else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Hammer the stock reservation engine and check that nothing is oversold.
+
+Runs against a throw-away database. Worker threads (optionally in several
+processes) place orders, hold and release cart lines, cancel orders
+(several threads often racing to cancel the same one) and let holds
+expire, all against a handful of medicines with little stock. At the end
+every unit must be accounted for:
+
+    initial stock == stock left + units in the orders table + units still held
+
+and stock must never go negative. Exits non-zero on any violation.
+
+    python benchmarks/stock_stress.py --threads 32 --ops 300 --processes 2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEDICINES = {"Paracetamol": 50, "Insulin": 20, "Antacid": 35, "Cough Syrup": 10}
+
+
+def seed(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS medicines (name TEXT PRIMARY KEY, price REAL, stock INTEGER)")
+    conn.executemany("INSERT OR REPLACE INTO medicines (name, price, stock) VALUES (?, 1.0, ?)", MEDICINES.items())
+    conn.commit()
+    conn.close()
+
+
+def worker_process(path, threads, ops, hold_seconds, seed_value, results):
+    os.environ["DB_NAME"] = path
+    os.environ["DB_POOL_SIZE"] = str(min(threads, 16))
+    sys.path.insert(0, ROOT)
+    from reservations import StockReservations, InsufficientStock
+    from data_storage import pool, medicines, orders, versions, init, write_order, generate_order_id
+
+    init()
+    engine = StockReservations(pool, medicines, hold_seconds=hold_seconds, versions=versions, orders=orders)
+    lock = threading.Lock()
+    placed = []  # ids of orders that may still be standing
+    counts = {"orders": 0, "rejected": 0, "cancelled": 0, "cancel_lost": 0, "holds": 0, "hold_rejected": 0}
+
+    def run(n):
+        rng = random.Random(seed_value * 1000 + n)
+        username = f"user-{seed_value}-{n}"
+        for _ in range(ops):
+            action = rng.random()
+            medicine = rng.choice(list(MEDICINES))
+            if action < 0.3:
+                try:
+                    engine.hold(username, medicine, rng.randint(1, 4))
+                    key = "holds"
+                except InsufficientStock:
+                    key = "hold_rejected"
+            elif action < 0.4:
+                engine.release(username, medicine)
+                key = None
+            elif action < 0.9:
+                items = {med: rng.randint(1, 3) for med in rng.sample(list(MEDICINES), rng.randint(1, 3))}
+                order_id = generate_order_id()
+                order = {"username": username, "items": items, "prescription": "stress", "status": "Processing",
+                         "delivery_time": datetime.now()}
+                try:
+                    engine.reserve(username, items, write=lambda conn: write_order(conn, order_id, order))
+                except InsufficientStock:
+                    key = "rejected"
+                else:
+                    key = "orders"
+                    with lock:
+                        placed.append(order_id)
+            else:
+                # Pick without removing, so other threads may cancel the same order at the same time
+                with lock:
+                    order_id = rng.choice(placed[-8:]) if placed else None
+                if order_id is None:
+                    continue
+                key = "cancelled" if engine.cancel(order_id) is not None else "cancel_lost"
+            if key:
+                with lock:
+                    counts[key] += 1
+
+    pool_threads = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for thread in pool_threads:
+        thread.start()
+    for thread in pool_threads:
+        thread.join()
+    results.put(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=32, help="worker threads per process")
+    parser.add_argument("--ops", type=int, default=200, help="operations per thread")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--hold-seconds", type=float, default=0.05, help="short holds exercise expiry")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="stock-stress-")
+    path = os.path.join(workdir, "stress.db")
+    seed(path)
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    started = time.perf_counter()
+    procs = [ctx.Process(target=worker_process, args=(path, args.threads, args.ops, args.hold_seconds, i, results))
+             for i in range(args.processes)]
+    for proc in procs:
+        proc.start()
+    outcomes = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - started
+
+    totals, ordered = {}, {}
+    for counts in outcomes:
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+    conn = sqlite3.connect(path)
+    for (items,) in conn.execute("SELECT items FROM orders"):
+        for med, qty in json.loads(items).items():
+            ordered[med] = ordered.get(med, 0) + qty
+    stock = dict(conn.execute("SELECT name, stock FROM medicines").fetchall())
+    held = dict(conn.execute("SELECT medicine, SUM(quantity) FROM stock_holds GROUP BY medicine").fetchall())
+    conn.close()
+
+    ok = True
+    for med, initial in MEDICINES.items():
+        accounted = stock[med] + ordered.get(med, 0) + held.get(med, 0)
+        status = "ok"
+        if stock[med] < 0 or accounted != initial:
+            status = "VIOLATION"
+            ok = False
+        print(f"{med:12} initial={initial:3} left={stock[med]:3} ordered={ordered.get(med, 0):4} "
+              f"held={held.get(med, 0):3} {status}")
+    ops = args.processes * args.threads * args.ops
+    print(f"{ops} operations in {elapsed:.2f}s ({ops / elapsed:.0f} ops/s): {totals}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
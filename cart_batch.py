@@ -0,0 +1,88 @@
+import os
+
+from data_storage import cart, medicines
+from reservations import reservations
+
+# Most operations accepted in one /cart/batch request
+CART_BATCH_MAX = int(os.getenv("CART_BATCH_MAX", "200"))
+OPERATIONS = ("add", "set", "remove")
+
+
+class CartBatchError(ValueError):
+    """The batch was rejected before touching anything; ``errors`` lists {"index", "error"} per bad operation."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(f"operation {e['index']}: {e['error']}" for e in errors[:5]))
+        self.errors = errors
+
+
+def validate_quantity(value, minimum):
+    """Return ``value`` if it is an integer of at least ``minimum``, else raise ValueError."""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("quantity must be an integer")
+    if value < minimum:
+        raise ValueError(f"quantity must be at least {minimum}")
+    return value
+
+
+def validate_operations(operations):
+    """Check every operation's shape and medicine; returns them as (op, medicine, quantity) tuples."""
+    if not isinstance(operations, list) or not operations:
+        raise CartBatchError([{"index": None, "error": "operations must be a non-empty list"}])
+    if len(operations) > CART_BATCH_MAX:
+        raise CartBatchError([{"index": None, "error": f"at most {CART_BATCH_MAX} operations per batch"}])
+    parsed, errors = [], []
+    for index, item in enumerate(operations):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("operation must be an object")
+            op, medicine = item.get("op"), item.get("medicine")
+            if op not in OPERATIONS:
+                raise ValueError(f"op must be one of {', '.join(OPERATIONS)}")
+            if not isinstance(medicine, str) or not medicine:
+                raise ValueError("medicine is required")
+            if op != "remove" and medicine not in medicines:
+                raise ValueError(f"medicine not found: {medicine}")
+            if op == "add":
+                quantity = validate_quantity(item.get("quantity", 1), 1)
+            elif op == "set":
+                quantity = validate_quantity(item.get("quantity"), 0)
+            else:
+                quantity = 0
+            parsed.append((op, medicine, quantity))
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+    if errors:
+        raise CartBatchError(errors)
+    return parsed
+
+
+def apply_cart_batch(username, operations):
+    """Apply add/set/remove operations to a user's cart all at once.
+
+    Operations are validated first, then folded in order into the final
+    quantity of each touched line. Stock holds and cart rows for every
+    changed line are written in one SQLite transaction, so either the whole
+    batch lands or nothing does. Raises CartBatchError for malformed
+    operations and InsufficientStock (naming every short line) when stock
+    can't cover the result. Returns the resulting cart and its subtotal.
+    """
+    parsed = validate_operations(operations)
+    with cart.lock(username):
+        current = cart.get(username)
+        final = dict(current)
+        for op, medicine, quantity in parsed:
+            if op == "add":
+                final[medicine] = final.get(medicine, 0) + quantity
+            elif op == "set" and quantity > 0:
+                final[medicine] = quantity
+            else:
+                final.pop(medicine, None)
+        changed = {medicine: final.get(medicine, 0) for medicine in set(current) | set(final)
+                   if final.get(medicine, 0) != current.get(medicine, 0)}
+        if changed:
+            bumped = reservations.set_holds(username, changed,
+                                            write=lambda conn: cart.write_lines(conn, username, changed))
+            cart.lines_written(username, changed, bumped)
+    subtotal = sum(medicines[m]["price"] * q for m, q in final.items() if m in medicines)
+    return {"cart": final, "subtotal": round(subtotal, 2), "changed": sorted(changed)}
@@ -0,0 +1,139 @@
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+
+# Number of locks carts are striped across; users hashing to different stripes never contend
+CART_LOCK_STRIPES = int(os.getenv("CART_LOCK_STRIPES", "64"))
+
+
+class CartStore:
+    """Per-user carts persisted in ``cart(username, medicine, quantity)``.
+
+    Each user's cart is loaded from SQLite on first use and then served from
+    memory, so reads are a dict lookup. Every change is written through to
+    the table straight away. Writers take one of CART_LOCK_STRIPES locks
+    chosen by username, so different users rarely contend. Callers that
+    need read-check-write consistency across several steps (placing an
+    order) hold ``lock(username)`` around them.
+    """
+
+    def __init__(self, pool, stripes=CART_LOCK_STRIPES, versions=None):
+        self._pool = pool
+        self._versions = versions
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self._carts = {}
+
+    def _stripe(self, username):
+        return self._locks[zlib.crc32(username.encode("utf-8")) % len(self._locks)]
+
+    @contextmanager
+    def lock(self, username):
+        with self._stripe(username):
+            yield
+
+    def _cart(self, username):
+        # Caller holds the user's stripe lock
+        cart = self._carts.get(username)
+        if cart is None:
+            with self._pool.connection() as conn:
+                rows = conn.execute("SELECT medicine, quantity FROM cart WHERE username = ?", (username,)).fetchall()
+            cart = dict(rows)
+            self._carts[username] = cart
+        return cart
+
+    def get(self, username):
+        """Return a copy of the user's cart as {medicine: quantity}."""
+        cart = self._carts.get(username)
+        if cart is None:
+            with self._stripe(username):
+                cart = self._cart(username)
+        return dict(cart)
+
+    def quantity(self, username, medicine):
+        return self.get(username).get(medicine, 0)
+
+    def _write(self, username, sql, params):
+        bumped = None
+        with self._pool.connection() as conn:
+            conn.execute(sql, params)
+            if self._versions is not None:
+                bumped = self._versions.bump_keys(conn, "cart", [username])
+            conn.commit()
+        if bumped:
+            self._versions.written(bumped)
+
+    def add(self, username, medicine, quantity):
+        """Add ``quantity`` to the line; returns the new quantity."""
+        with self._stripe(username):
+            cart = self._cart(username)
+            new_qty = cart.get(medicine, 0) + quantity
+            self._write(username, "INSERT OR REPLACE INTO cart (username, medicine, quantity) VALUES (?, ?, ?)",
+                        (username, medicine, new_qty))
+            cart[medicine] = new_qty
+            return new_qty
+
+    def set(self, username, medicine, quantity):
+        """Set the line to ``quantity``; zero or less removes it."""
+        if quantity <= 0:
+            self.remove(username, medicine)
+            return
+        with self._stripe(username):
+            cart = self._cart(username)
+            self._write(username, "INSERT OR REPLACE INTO cart (username, medicine, quantity) VALUES (?, ?, ?)",
+                        (username, medicine, quantity))
+            cart[medicine] = quantity
+
+    def remove(self, username, medicine):
+        """Remove a line; returns False if it was not in the cart."""
+        with self._stripe(username):
+            cart = self._cart(username)
+            if medicine not in cart:
+                return False
+            self._write(username, "DELETE FROM cart WHERE username = ? AND medicine = ?", (username, medicine))
+            del cart[medicine]
+            return True
+
+    def clear(self, username):
+        with self._stripe(username):
+            cart = self._cart(username)
+            self._write(username, "DELETE FROM cart WHERE username = ?", (username,))
+            cart.clear()
+
+    def write_lines(self, conn, username, lines):
+        """Write final quantities for several lines (0 removes) on the caller's connection and transaction.
+
+        Nothing changes in memory until ``lines_written()`` is called with the
+        result after the caller commits.
+        """
+        conn.executemany("DELETE FROM cart WHERE username = ? AND medicine = ?",
+                         [(username, medicine) for medicine, quantity in lines.items() if quantity <= 0])
+        conn.executemany("INSERT OR REPLACE INTO cart (username, medicine, quantity) VALUES (?, ?, ?)",
+                         [(username, medicine, quantity) for medicine, quantity in lines.items() if quantity > 0])
+        return self._versions.bump_keys(conn, "cart", [username]) if self._versions is not None else None
+
+    def lines_written(self, username, lines, bumped=None):
+        with self._stripe(username):
+            cart = self._cart(username)
+            for medicine, quantity in lines.items():
+                if quantity > 0:
+                    cart[medicine] = quantity
+                else:
+                    cart.pop(medicine, None)
+        if bumped:
+            self._versions.written(bumped)
+
+    def invalidate(self):
+        """Drop every in-memory cart (another process changed the table)."""
+        self.forget(list(self._carts))
+
+    def forget(self, usernames):
+        """Drop these users' in-memory carts; the next access reloads them from SQLite."""
+        by_stripe = {}
+        for username in usernames:
+            by_stripe.setdefault(self._stripe(username), []).append(username)
+        # Under each stripe's lock, so a write in progress lands before its cart is dropped
+        for lock, names in by_stripe.items():
+            with lock:
+                for username in names:
+                    self._carts.pop(username, None)
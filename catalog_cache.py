@@ -0,0 +1,219 @@
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from data_storage import medicines
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+CATALOG_COMPRESS_MIN_BYTES = int(os.getenv("CATALOG_COMPRESS_MIN_BYTES", "1024"))
+# Rendered index pages kept per catalog version (one per logged-in user); 0 disables
+INDEX_CACHE_SIZE = int(os.getenv("INDEX_CACHE_SIZE", "256"))
+
+
+def _compress(encoding, body):
+    if encoding == "br":
+        return brotli.compress(body)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def accepted_encodings(header):
+    """Content codings the client accepts (q=0 excluded), from an Accept-Encoding header."""
+    accepted = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def entity_tags(header):
+    """Opaque tags (without W/ and quotes) listed in an If-None-Match header; ``*`` is kept as is."""
+    tags = []
+    for candidate in (header or "").split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate:
+            tags.append(candidate if candidate == "*" else candidate.strip('"'))
+    return tags
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header names ``etag`` exactly, or is ``*``."""
+    tags = entity_tags(if_none_match)
+    return "*" in tags or etag.strip('"') in tags
+
+
+class CatalogCache:
+    """The serialized catalog, rebuilt only when the catalog version moves.
+
+    ``version`` goes up on every catalog change (admin add/remove, price and
+    stock edits, reloads from other workers). The JSON body for a version is
+    built once; compressed variants are made on first request and kept with
+    it. Each medicine's JSON is kept between builds and only changed
+    medicines are serialized again, so a stock change costs a join rather
+    than a full dump. The ETag is a hash of the body, so every worker
+    process hands out the same validator for the same catalog.
+    """
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.version = 0
+        self._snapshot = None
+        self._fragments = {}  # name -> '"name":{...}'
+        self._names = []      # sorted names, the order json.dumps(sort_keys=True) uses
+        self._stale = None    # names changed since the last build; None means every name
+        self.builds = 0
+        catalog.subscribe(self._on_change)
+
+    def _on_change(self, name):
+        with self._lock:
+            self.version += 1
+            if self._stale is not None:
+                self._stale.add(name)
+
+    def _fragment(self, name, details):
+        return json.dumps(name) + ":" + json.dumps(dict(details), sort_keys=True, separators=(",", ":"))
+
+    def _update_fragments(self, stale):
+        # Caller holds the build lock
+        if stale is None:
+            rows = list(self._catalog.items())
+            self._fragments = {name: self._fragment(name, details) for name, details in rows}
+            self._names = sorted(self._fragments)
+            return
+        for name in stale:
+            details = self._catalog.get(name)
+            if details is None:
+                if self._fragments.pop(name, None) is not None:
+                    del self._names[bisect.bisect_left(self._names, name)]
+            else:
+                if name not in self._fragments:
+                    bisect.insort(self._names, name)
+                self._fragments[name] = self._fragment(name, details)
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot["version"] == self.version:
+            return snapshot
+        with self._build_lock:
+            snapshot = self._snapshot
+            with self._lock:
+                version = self.version
+                if snapshot is not None and snapshot["version"] == version:
+                    return snapshot
+                stale, self._stale = self._stale, set()
+            self._update_fragments(stale)
+            fragments = self._fragments
+            body = ("{" + ",".join([fragments[name] for name in self._names]) + "}").encode("utf-8")
+        snapshot = {"version": version, "tag": hashlib.sha256(body).hexdigest()[:32], "identity": body}
+        with self._lock:
+            self.builds += 1
+            # Don't replace a snapshot for a newer version built by another thread
+            if self._snapshot is None or self._snapshot["version"] <= version:
+                self._snapshot = snapshot
+        return snapshot
+
+    def etag(self):
+        return self._current()["tag"]
+
+    def payload(self, accept_encoding=""):
+        """Return (body, content encoding or None, strong ETag) for the current catalog."""
+        snapshot = self._current()
+        body = snapshot["identity"]
+        encoding = None
+        if len(body) >= CATALOG_COMPRESS_MIN_BYTES:
+            accepted = accepted_encodings(accept_encoding)
+            if brotli is not None and "br" in accepted:
+                encoding = "br"
+            elif "gzip" in accepted:
+                encoding = "gzip"
+        if encoding is None:
+            return body, None, f'"{snapshot["tag"]}"'
+        compressed = snapshot.get(encoding)
+        if compressed is None:
+            compressed = snapshot[encoding] = _compress(encoding, body)
+        return compressed, encoding, f'"{snapshot["tag"]}-{encoding}"'
+
+    def html_json(self):
+        """The catalog JSON escaped for a <script> element, as Jinja's tojson would."""
+        snapshot = self._current()
+        fragment = snapshot.get("html")
+        if fragment is None:
+            text = snapshot["identity"].decode("utf-8")
+            fragment = snapshot["html"] = (text.replace("<", "\\u003c").replace(">", "\\u003e")
+                                           .replace("&", "\\u0026").replace("'", "\\u0027"))
+        return fragment
+
+    def matches(self, if_none_match):
+        """True if an If-None-Match header names the current catalog (in any encoding)."""
+        tags = entity_tags(if_none_match)
+        if not tags:
+            return False
+        tag = self._current()["tag"]
+        return any(candidate == "*" or candidate.split("-")[0] == tag for candidate in tags)
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {"version": self.version, "builds": self.builds,
+                "bytes": len(snapshot["identity"]) if snapshot else 0,
+                "encodings": sorted(k for k in ("gzip", "br") if snapshot and k in snapshot)}
+
+
+class RenderCache:
+    """Rendered pages keyed on the catalog version plus a per-page key (the user).
+
+    All entries belong to one catalog version; the first lookup for a newer
+    version drops them. Each page carries an ETag so a browser revalidating
+    an unchanged page gets a 304.
+    """
+
+    def __init__(self, size=INDEX_CACHE_SIZE):
+        self._size = size
+        self._lock = threading.Lock()
+        self._version = None
+        self._pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, key, render):
+        """Return (page, etag), calling ``render()`` only on a miss."""
+        with self._lock:
+            if self._version is None or version > self._version:
+                self._pages.clear()
+                self._version = version
+            cached = self._pages.get(key) if version == self._version else None
+            if cached is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        page = render()
+        cached = (page, f'"{hashlib.sha256(page.encode("utf-8")).hexdigest()[:32]}"')
+        with self._lock:
+            if self._size > 0 and version == self._version:
+                self._pages[key] = cached
+                while len(self._pages) > self._size:
+                    self._pages.popitem(last=False)
+        return cached
+
+    def stats(self):
+        with self._lock:
+            return {"version": self._version, "pages": len(self._pages), "hits": self.hits, "misses": self.misses}
+
+
+catalog_cache = CatalogCache(medicines)
+index_cache = RenderCache()
@@ -0,0 +1,225 @@
+"""Bulk catalog import and export as CSV or JSONL.
+
+    python catalog_io.py import distributor.csv [--dry-run]
+    python catalog_io.py export medicines.jsonl
+"""
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sys
+
+from data_storage import pool, medicines, versions, flush_pending, reload_catalog, init
+import reservations  # noqa: F401 - init() must create stock_holds, which imports and exports read
+
+# Rows upserted per executemany transaction (and read per page when exporting)
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "2000"))
+# Row errors listed in an import report; all of them are counted
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+FORMATS = ("csv", "jsonl")
+FIELDS = ("name", "price", "stock")
+
+# Files carry the units on hand, held ones included, while medicines.stock excludes units held in
+# carts (holds are added back when released or expired), so imports subtract outstanding holds
+# and exports add them back. Holds exceeding an imported count leave stock negative until released.
+_UPSERT = ("INSERT INTO medicines (name, price, stock) VALUES (?, ?, ?) "
+           "ON CONFLICT(name) DO UPDATE SET price = excluded.price, stock = excluded.stock - "
+           "COALESCE((SELECT SUM(quantity) FROM stock_holds WHERE medicine = excluded.name), 0)")
+_EXPORT = ("SELECT name, price, stock + COALESCE((SELECT SUM(quantity) FROM stock_holds "
+           "WHERE medicine = medicines.name), 0) FROM medicines")
+
+
+def guess_format(filename="", content_type=""):
+    """csv or jsonl from a file name or content type; None if neither says."""
+    filename, content_type = (filename or "").lower(), (content_type or "").lower()
+    if filename.endswith(".csv") or "csv" in content_type:
+        return "csv"
+    if filename.endswith((".jsonl", ".ndjson")) or "ndjson" in content_type or "jsonl" in content_type:
+        return "jsonl"
+    return None
+
+
+def validate_row(row):
+    """Return (name, price, stock) for a parsed row or raise ValueError saying what is wrong."""
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+    name = str(row.get("name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    price, stock = row.get("price"), row.get("stock")
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid price {price!r}")
+    if not math.isfinite(price) or price < 0:
+        raise ValueError("price must be a non-negative number")
+    try:
+        if isinstance(stock, bool) or (isinstance(stock, float) and not stock.is_integer()):
+            raise ValueError
+        stock = int(stock) if isinstance(stock, (int, float)) else int(str(stock).strip())
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid stock {stock!r}")
+    if stock < 0:
+        raise ValueError("stock must be a non-negative integer")
+    return name, price, stock
+
+
+def read_rows(lines, fmt):
+    """Yield (line number, row, error) for each record of CSV or JSONL text, without reading ahead."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        missing = set(FIELDS) - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"CSV header must name the columns {', '.join(FIELDS)} "
+                             f"(missing {', '.join(sorted(missing))})")
+        for row in reader:
+            yield reader.line_num, row, None
+    elif fmt == "jsonl":
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line), None
+            except ValueError as e:
+                yield number, None, f"invalid JSON: {e}"
+    else:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+
+
+def _write_chunk(rows):
+    with pool.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(_UPSERT, rows)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def _publish():
+    # One version bump for the whole import: other workers reload the catalog once
+    with pool.connection() as conn:
+        bumped = versions.bump(conn, "medicines")
+        conn.commit()
+    reload_catalog()
+    versions.written(bumped)
+
+
+def import_catalog(lines, fmt, dry_run=False, chunk_rows=IMPORT_CHUNK_ROWS, max_errors=IMPORT_MAX_ERRORS):
+    """Validate and upsert medicines streamed from ``lines`` (an iterable of CSV or JSONL text lines).
+
+    Rows are validated one at a time; bad rows are skipped and reported with
+    their line number. Good rows are written in chunks of ``chunk_rows``, one
+    executemany transaction each, so a large file never sits in memory.
+    Existing medicines get the file's price and stock, where stock counts
+    units on hand including those held in carts. The catalog version is
+    bumped once at the end (also if a chunk fails part way), and the
+    in-memory catalog is reloaded once. With ``dry_run`` nothing is written.
+    """
+    if not dry_run and medicines.has_changes():
+        flush_pending()  # don't let an older write-behind batch land on top of the import
+    report = {"format": fmt, "dry_run": dry_run, "rows": 0, "imported": 0, "chunks": 0,
+              "error_count": 0, "errors": []}
+    chunk = []
+    try:
+        for line, row, error in read_rows(lines, fmt):
+            report["rows"] += 1
+            try:
+                if error:
+                    raise ValueError(error)
+                chunk.append(validate_row(row))
+            except ValueError as e:
+                report["error_count"] += 1
+                if len(report["errors"]) < max_errors:
+                    report["errors"].append({"line": line, "error": str(e)})
+                continue
+            if len(chunk) >= chunk_rows:
+                if not dry_run:
+                    _write_chunk(chunk)
+                report["imported"] += len(chunk)
+                report["chunks"] += 1
+                chunk = []
+        if chunk:
+            if not dry_run:
+                _write_chunk(chunk)
+            report["imported"] += len(chunk)
+            report["chunks"] += 1
+    finally:
+        if report["chunks"] and not dry_run:
+            _publish()
+    return report
+
+
+def export_catalog(fmt, page_rows=IMPORT_CHUNK_ROWS):
+    """Yield the catalog as CSV or JSONL text in name order, reading SQLite one page at a time.
+
+    Stock is exported as units on hand, held ones included, so an export imports back unchanged.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if medicines.has_changes():
+        flush_pending()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(FIELDS)
+    after = None
+    while True:
+        # A connection per page, so a slow reader doesn't hold one for the whole download
+        with pool.connection() as conn:
+            if after is None:
+                rows = conn.execute(f"{_EXPORT} ORDER BY name LIMIT ?", (page_rows,)).fetchall()
+            else:
+                rows = conn.execute(f"{_EXPORT} WHERE name > ? ORDER BY name LIMIT ?", (after, page_rows)).fetchall()
+        if fmt == "csv":
+            writer.writerows(rows)
+        else:
+            buffer.writelines(json.dumps(dict(zip(FIELDS, row))) + "\n" for row in rows)
+        if buffer.tell():
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if len(rows) < page_rows:
+            return
+        after = rows[-1][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    load = sub.add_parser("import", help="upsert medicines from a CSV or JSONL file ('-' for stdin)")
+    load.add_argument("path")
+    load.add_argument("--format", choices=FORMATS)
+    load.add_argument("--dry-run", action="store_true", help="validate only")
+    dump = sub.add_parser("export", help="write the catalog as CSV or JSONL ('-' or no path for stdout)")
+    dump.add_argument("path", nargs="?", default="-")
+    dump.add_argument("--format", choices=FORMATS)
+    args = parser.parse_args()
+
+    fmt = args.format or guess_format(args.path)
+    if fmt is None:
+        parser.error("can't tell the format from the file name; pass --format")
+    init()
+    if args.command == "import":
+        source = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8-sig", newline="")
+        with source:
+            try:
+                report = import_catalog(source, fmt, dry_run=args.dry_run)
+            except ValueError as e:
+                sys.exit(str(e))
+        for error in report["errors"]:
+            print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+        print(f"{report['imported']} of {report['rows']} rows {'valid' if args.dry_run else 'imported'}, "
+              f"{report['error_count']} error(s)")
+        sys.exit(1 if report["error_count"] else 0)
+    target = sys.stdout if args.path == "-" else open(args.path, "w", encoding="utf-8", newline="")
+    with target:
+        for chunk in export_catalog(fmt):
+            target.write(chunk)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import bisect
+import threading
+from collections import defaultdict
+
+from data_storage import medicines
+
+# How many prefix entries to inspect per query before ranking; bounds work for one-letter queries
+PREFIX_SCAN_LIMIT = 512
+# Upper bound on candidates gathered from trigram postings for fuzzy matching
+FUZZY_CANDIDATE_LIMIT = 1000
+# Minimum trigram similarity (Jaccard) for a fuzzy hit
+FUZZY_MIN_SIMILARITY = 0.3
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def trigrams(text):
+    # Leading padding makes the first letters count more, which favours prefix-like typos
+    padded = f"  {text}"
+    return frozenset([padded[i:i + 3] for i in range(len(padded) - 2)])
+
+
+class CatalogSearchIndex:
+    """Ranked name search over the medicine catalog.
+
+    Keeps a sorted list of (word-suffix, name) keys for prefix lookups with
+    bisect (every word start of a name is a key, so "syr" finds "Cough Syrup")
+    and trigram postings for substring and typo-tolerant matches. When built
+    from a TrackedDict the index subscribes to it and follows admin
+    additions and removals. A catalog index is built on the first search,
+    not at import.
+    """
+
+    def __init__(self, catalog=None):
+        self._lock = threading.RLock()
+        self._names = {}        # name -> normalized name
+        self._grams = {}        # name -> trigram set
+        self._prefix_keys = []  # sorted (normalized suffix starting at a word, name)
+        self._postings = defaultdict(set)  # trigram -> set of names
+        self._catalog = catalog
+        self._built = catalog is None
+        if catalog is not None and hasattr(catalog, "subscribe"):
+            catalog.subscribe(self._on_change)
+
+    def _ensure_built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self.rebuild(self._catalog)
+
+    def __len__(self):
+        self._ensure_built()
+        return len(self._names)
+
+    def __contains__(self, name):
+        self._ensure_built()
+        return name in self._names
+
+    def rebuild(self, names):
+        with self._lock:
+            self._names, self._grams, self._postings = {}, {}, defaultdict(set)
+            keys = []
+            for name in list(names):
+                keys.extend(self._index(name))
+            keys.sort()
+            self._prefix_keys = keys
+            self._built = True
+
+    def _index(self, name):
+        # Caller holds the lock; returns the prefix keys for the caller to place
+        norm = normalize(name)
+        grams = trigrams(norm)
+        self._names[name] = norm
+        self._grams[name] = grams
+        postings = self._postings
+        for gram in grams:
+            postings[gram].add(name)
+        return [(norm[i:], name) for i in range(len(norm)) if i == 0 or norm[i - 1] == " "]
+
+    def add(self, name):
+        with self._lock:
+            if name in self._names:
+                return
+            for key in self._index(name):
+                bisect.insort(self._prefix_keys, key)
+
+    def remove(self, name):
+        with self._lock:
+            norm = self._names.pop(name, None)
+            if norm is None:
+                return
+            for gram in self._grams.pop(name):
+                names = self._postings.get(gram)
+                names.discard(name)
+                if not names:
+                    del self._postings[gram]
+            for i in range(len(norm)):
+                if i == 0 or norm[i - 1] == " ":
+                    pos = bisect.bisect_left(self._prefix_keys, (norm[i:], name))
+                    if pos < len(self._prefix_keys) and self._prefix_keys[pos] == (norm[i:], name):
+                        del self._prefix_keys[pos]
+
+    def _on_change(self, name):
+        # Stock/price edits also notify; only membership matters here
+        with self._lock:
+            if not self._built:
+                return  # the first search reads the whole catalog anyway
+            if dict.__contains__(self._catalog, name):
+                self.add(name)
+            else:
+                self.remove(name)
+
+    def search(self, query, limit=10):
+        """Return up to ``limit`` (name, score) pairs, best first.
+
+        Scores: 100 exact, ~80 name prefix, ~60 word prefix, ~40 substring,
+        below 30 for fuzzy (trigram) matches.
+        """
+        q = normalize(query)
+        if not q or limit <= 0:
+            return []
+        self._ensure_built()
+        scores = {}
+        with self._lock:
+            keys = self._prefix_keys
+            i = bisect.bisect_left(keys, (q,))
+            end = min(len(keys), i + PREFIX_SCAN_LIMIT)
+            while i < end and keys[i][0].startswith(q):
+                suffix, name = keys[i]
+                norm = self._names[name]
+                if norm == q:
+                    score = 100.0
+                else:
+                    # Prefer names where the query covers more of the name
+                    score = (80.0 if suffix == norm else 60.0) + 10.0 * len(q) / len(norm)
+                if score > scores.get(name, 0):
+                    scores[name] = score
+                i += 1
+            if len(scores) < limit and len(q) >= 3:
+                self._fuzzy(q, scores)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(name, round(score, 2)) for name, score in ranked[:limit]]
+
+    def _fuzzy(self, q, scores):
+        # Caller holds the lock. Gather candidates from the rarest trigrams first.
+        q_grams = trigrams(q)
+        postings = sorted((self._postings[g] for g in q_grams if g in self._postings), key=len)
+        candidates = set()
+        for names in postings:
+            if candidates and len(candidates) + len(names) > FUZZY_CANDIDATE_LIMIT:
+                break
+            candidates |= names
+        for name in candidates:
+            if name in scores:
+                continue
+            if q in self._names[name]:
+                scores[name] = 40.0 + 10.0 * len(q) / len(self._names[name])
+                continue
+            grams = self._grams[name]
+            shared = len(q_grams & grams)
+            similarity = shared / (len(q_grams) + len(grams) - shared)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scores[name] = 30.0 * similarity
+
+
+catalog_index = CatalogSearchIndex(medicines)
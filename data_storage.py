@@ -1,13 +1,72 @@
 import sqlite3
+from collections import OrderedDict
 from datetime import datetime, timedelta
-import uuid
+import os
+import json
+import ast
+import atexit
+import threading
+from db_pool import ConnectionPool
+from cart_store import CartStore
+from state_versions import VersionTracker, init_versions_table
+from metrics import registry, TimedConnection
+from order_ids import order_ids, id_floor, ORDER_ID_LENGTH
 
 # Database setup
-DB_NAME = "delivery.db"
+DB_NAME = os.getenv("DB_NAME", "delivery.db")
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Number of recently used orders kept in memory by the order repository
+ORDER_CACHE_SIZE = int(os.getenv("ORDER_CACHE_SIZE", "1024"))
+# Statements are timed into the sqlite_statement_seconds metric unless metrics are off
+pool = ConnectionPool(DB_NAME, size=int(os.getenv("DB_POOL_SIZE", "8")),
+                      factory=TimedConnection if registry.enabled else sqlite3.Connection)
+atexit.register(pool.close_all)
+
+def pool_stats():
+    return pool.stats()
+
+_schema_hooks = []
+_init_lock = threading.Lock()
+_initialized = False
+
+def on_init(hook):
+    """Register ``hook(conn)`` to create another module's tables during init_db()."""
+    _schema_hooks.append(hook)
+    if _initialized:
+        with pool.connection() as conn:
+            hook(conn)
 
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
+    with pool.connection() as conn:
+        _init_schema(conn)
+        init_versions_table(conn)
+        for hook in _schema_hooks:
+            hook(conn)
+
+def init():
+    """Set up the schema and load the catalog and users; later calls do nothing.
+
+    Importing this module touches neither the database nor the disk: this is
+    the only place that creates, migrates or seeds tables. The server calls it
+    on the first request (or at startup), the CLI before showing its menu.
+    """
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        init_db()
+        with pool.connection() as conn:
+            versions.reset(conn)
+            medicines.reload(_read_medicines(conn))
+            users.reload(_read_users(conn))
+        _initialized = True
+
+def _init_schema(conn):
     c = conn.cursor()
+    # Serialize with other processes initializing the same file
+    c.execute("BEGIN IMMEDIATE")
     # Create tables if they don't exist, removing indian_price column
     c.execute('''CREATE TABLE IF NOT EXISTS medicines 
                  (name TEXT PRIMARY KEY, price REAL, stock INTEGER)''')
@@ -16,7 +75,19 @@ def init_db():
     c.execute('''CREATE TABLE IF NOT EXISTS orders 
                  (order_id TEXT PRIMARY KEY, username TEXT, items TEXT, prescription TEXT, status TEXT, delivery_time TEXT)''')
     c.execute('''CREATE TABLE IF NOT EXISTS cart 
-                 (medicine TEXT, quantity INTEGER, PRIMARY KEY (medicine))''')
+                 (username TEXT, medicine TEXT, quantity INTEGER, PRIMARY KEY (username, medicine))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS order_items
+                 (order_id TEXT, medicine TEXT, quantity INTEGER, unit_price REAL, PRIMARY KEY (order_id, medicine))''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_items_medicine ON order_items (medicine)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_username ON orders (username)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_delivery_time ON orders (delivery_time)")
+    if c.execute("PRAGMA user_version").fetchone()[0] < 1:
+        _migrate_order_items(c)
+        c.execute("PRAGMA user_version = 1")
+    if c.execute("PRAGMA user_version").fetchone()[0] < 2:
+        _migrate_cart(c)
+        c.execute("PRAGMA user_version = 2")
     # Initialize with default medicines if empty
     c.execute("SELECT name FROM medicines")
     if not c.fetchall():
@@ -36,47 +107,789 @@ def init_db():
             ("Livogon", 20, 25)         # Added for prescription scanning
         ]
         c.executemany("INSERT OR IGNORE INTO medicines (name, price, stock) VALUES (?, ?, ?)", default_medicines)
+    # Ensure there is at least one admin user for admin login
+    c.execute("INSERT OR IGNORE INTO users (username, password, address) VALUES ('admin', 'admin123', 'Admin Panel')")
     conn.commit()
-    conn.close()
+
+def _encode_items(items):
+    return json.dumps(items, separators=(',', ':'))
+
+def _migrate_order_items(c):
+    # Schema v1: orders.items used to hold str(dict) and was read back with eval().
+    # Rewrite it as compact JSON and copy every line into order_items.
+    prices = dict(c.execute("SELECT name, price FROM medicines").fetchall())
+    encoded, lines = [], []
+    for oid, raw in c.execute("SELECT order_id, items FROM orders").fetchall():
+        try:
+            items = json.loads(raw)
+        except (TypeError, ValueError):
+            items = ast.literal_eval(raw) if raw else {}
+        encoded.append((_encode_items(items), oid))
+        lines.extend((oid, med, qty, prices.get(med)) for med, qty in items.items())
+    c.executemany("UPDATE orders SET items = ? WHERE order_id = ?", encoded)
+    c.executemany("INSERT OR IGNORE INTO order_items (order_id, medicine, quantity, unit_price) VALUES (?, ?, ?, ?)", lines)
+
+def _migrate_cart(c):
+    # Schema v2: the cart used to be one global (medicine, quantity) table.
+    # Existing lines are kept under the empty username.
+    columns = [row[1] for row in c.execute("PRAGMA table_info(cart)").fetchall()]
+    if "username" in columns:
+        return
+    c.execute("ALTER TABLE cart RENAME TO cart_v1")
+    c.execute('''CREATE TABLE cart 
+                 (username TEXT, medicine TEXT, quantity INTEGER, PRIMARY KEY (username, medicine))''')
+    c.execute("INSERT INTO cart (username, medicine, quantity) SELECT '', medicine, quantity FROM cart_v1")
+    c.execute("DROP TABLE cart_v1")
+
+class TrackedDict(dict):
+    """dict that records which keys were set or deleted since the last flush.
+
+    Values that are plain dicts (medicine, user and order rows) are wrapped so
+    that in-place edits such as ``medicines[m]['stock'] -= 1`` also mark the
+    owning key dirty.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._deleted = set()
+        self._listeners = []
+        for key, value in dict(*args, **kwargs).items():
+            dict.__setitem__(self, key, self._wrap(key, value))
+
+    def _wrap(self, key, value):
+        if type(value) is dict:
+            return _TrackedRow(value, self, key)
+        return value
+
+    def subscribe(self, listener):
+        """Call ``listener(key)`` after every change to a key (set, delete or row edit)."""
+        self._listeners.append(listener)
+
+    def _notify(self, key):
+        for listener in self._listeners:
+            listener(key)
+
+    def _touch(self, key):
+        with self._lock:
+            self._dirty.add(key)
+            self._deleted.discard(key)
+        self._notify(key)
+
+    def _forget(self, key):
+        with self._lock:
+            self._deleted.add(key)
+            self._dirty.discard(key)
+        self._notify(key)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, self._wrap(key, value))
+        self._touch(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._forget(key)
+
+    def pop(self, key, *default):
+        had_key = key in self
+        value = dict.pop(self, key, *default)
+        if had_key:
+            self._forget(key)
+        return value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._forget(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        keys = list(self.keys())
+        dict.clear(self)
+        for key in keys:
+            self._forget(key)
+
+    def has_changes(self):
+        return bool(self._dirty or self._deleted)
+
+    def refresh(self, key, **fields):
+        """Apply values that are already in SQLite to a row without marking it dirty."""
+        row = dict.get(self, key)
+        if row is None:
+            return
+        dict.update(row, fields)
+        self._notify(key)
+
+    def reload(self, data, keys=None):
+        """Replace the contents with rows read from SQLite, keeping unsaved local changes.
+
+        Rows are updated in place, so fields that are not stored in the table
+        (such as ``is_admin``) survive; listeners hear about every key that changed.
+        With ``keys``, only those keys are refreshed and ``data`` holds the
+        ones that still exist.
+        """
+        changed = []
+        with self._lock:
+            pending = self._dirty | self._deleted
+            for key in list(dict.keys(self)) if keys is None else keys:
+                if key not in data and key not in pending and dict.__contains__(self, key):
+                    dict.__delitem__(self, key)
+                    changed.append(key)
+            for key, value in data.items():
+                if key in pending:
+                    continue
+                current = dict.get(self, key)
+                if isinstance(current, dict) and isinstance(value, dict):
+                    if any(current.get(field) != v for field, v in value.items()):
+                        dict.update(current, value)
+                        changed.append(key)
+                elif current != value or not dict.__contains__(self, key):
+                    dict.__setitem__(self, key, self._wrap(key, value))
+                    changed.append(key)
+        for key in changed:
+            self._notify(key)
+        return changed
+
+    def _row_changed(self, key, row):
+        # Only report if this row is still the one stored under its key
+        if dict.get(self, key) is row:
+            self._touch(key)
+
+    def drain_changes(self):
+        """Return and reset the pending changes as ({key: row}, deleted keys)."""
+        with self._lock:
+            dirty, deleted = self._dirty, self._deleted
+            self._dirty, self._deleted = set(), set()
+        rows = {}
+        for key in dirty:
+            if dict.__contains__(self, key):
+                rows[key] = dict.__getitem__(self, key)
+            else:
+                deleted.add(key)
+        return rows, deleted
+
+    def restore_changes(self, rows, deleted):
+        """Re-mark keys whose flush failed so the next save retries them."""
+        with self._lock:
+            self._dirty |= set(rows) - self._deleted
+            self._deleted |= deleted - self._dirty
+
+    def changes_committed(self, rows, deleted):
+        pass
+
+    def discard_changes(self):
+        """Forget pending changes without writing them (a forked child; the parent flushes them)."""
+        self._lock = threading.Lock()
+        self._dirty, self._deleted = set(), set()
+
+
+class _TrackedRow(dict):
+    """A row inside a tracked collection; any mutation marks the owning key dirty."""
+
+    def __init__(self, data, owner, key):
+        super().__init__(data)
+        self._owner = owner
+        self._key = key
+
+    def _changed(self):
+        self._owner._row_changed(self._key, self)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._changed()
+
+    def pop(self, key, *default):
+        value = dict.pop(self, key, *default)
+        self._changed()
+        return value
+
+    def setdefault(self, key, default=None):
+        value = dict.setdefault(self, key, default)
+        self._changed()
+        return value
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._changed()
+
+    def copy(self):
+        return dict(self)
+
+
+_ORDER_COLUMNS = "order_id, username, items, prescription, status, delivery_time"
+
+def _order_from_row(row):
+    return {"username": row[1], "items": json.loads(row[2]), "prescription": row[3], "status": row[4],
+            "delivery_time": datetime.strptime(row[5], DATE_FORMAT)}
+
+
+class OrderRepository:
+    """Dict-like access to the orders table backed by SQLite indexes.
+
+    Orders are read on demand and the most recently used ones are kept in a
+    bounded LRU. New or modified orders stay pinned in memory until the next
+    save_data flush writes them, so the repository plugs into save_data the
+    same way a TrackedDict does.
+    """
+
+    def __init__(self, pool, cache_size=1024):
+        self._pool = pool
+        self._cache_size = cache_size
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._deleted = set()
+        self._flushing_deleted = set()
+        # Orders added with orders[oid] = ...; the flush inserts these and only updates the rest
+        self._inserted = set()
+        self._flushing_inserted = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _wrap(self, oid, order):
+        if isinstance(order, _TrackedRow) and order._owner is self and order._key == oid:
+            return order
+        return _TrackedRow(order, self, oid)
+
+    def _remember(self, oid, order):
+        # Caller holds self._lock
+        self._cache[oid] = order
+        self._cache.move_to_end(oid)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def _row_changed(self, oid, order):
+        with self._lock:
+            if oid not in self._deleted:
+                self._dirty[oid] = order
+
+    def _lookup(self, oid):
+        with self._lock:
+            if oid in self._deleted or oid in self._flushing_deleted:
+                return None
+            order = self._dirty.get(oid)
+            if order is not None:
+                return order
+            order = self._cache.get(oid)
+            if order is not None:
+                self._cache.move_to_end(oid)
+                self.hits += 1
+                return order
+            self.misses += 1
+        with self._pool.connection() as conn:
+            row = conn.execute(f"SELECT {_ORDER_COLUMNS} FROM orders WHERE order_id = ?", (oid,)).fetchone()
+        if row is None:
+            return None
+        return self._adopt(row)
+
+    def _adopt(self, row, remember=True):
+        oid = row[0]
+        with self._lock:
+            if oid in self._deleted or oid in self._flushing_deleted:
+                return None
+            # Prefer an object that is already live so callers share one copy
+            order = self._dirty.get(oid) or self._cache.get(oid)
+            if order is None:
+                order = _TrackedRow(_order_from_row(row), self, oid)
+            if remember and oid not in self._dirty:
+                self._remember(oid, order)
+            return order
+
+    def __contains__(self, oid):
+        return self._lookup(oid) is not None
+
+    def __getitem__(self, oid):
+        order = self._lookup(oid)
+        if order is None:
+            raise KeyError(oid)
+        return order
+
+    def get(self, oid, default=None):
+        order = self._lookup(oid)
+        return default if order is None else order
+
+    def __setitem__(self, oid, order):
+        with self._lock:
+            order = self._wrap(oid, order)
+            self._deleted.discard(oid)
+            self._dirty[oid] = order
+            self._inserted.add(oid)
+            self._remember(oid, order)
+
+    def __delitem__(self, oid):
+        if self._lookup(oid) is None:
+            raise KeyError(oid)
+        with self._lock:
+            self._dirty.pop(oid, None)
+            self._inserted.discard(oid)
+            self._cache.pop(oid, None)
+            self._deleted.add(oid)
+
+    def pop(self, oid, *default):
+        # Look up and delete under one lock hold so concurrent pops remove an order only once
+        with self._lock:
+            order = self._lookup(oid)
+            if order is None:
+                if default:
+                    return default[0]
+                raise KeyError(oid)
+            del self[oid]
+        return order
+
+    def query(self, where="", params=(), limit=None, remember=True):
+        """Return [(order_id, order)] for orders matching an SQL condition, oldest id first.
+
+        Unflushed changes are merged into the result, so callers always see
+        their own writes. With ``remember=False`` rows read from disk are not
+        added to the LRU, which keeps bulk exports from evicting hot orders.
+        """
+        sql = f"SELECT {_ORDER_COLUMNS} FROM orders"
+        if where:
+            sql += f" WHERE {where}"
+        sql += " ORDER BY order_id"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self._pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        found = {}
+        for row in rows:
+            order = self._adopt(row, remember)
+            if order is not None:
+                found[row[0]] = order
+        with self._lock:
+            pending = dict(self._dirty)
+        if pending:
+            matches = _match_pending(pending, where, params)
+            for oid, order in pending.items():
+                if oid in matches:
+                    found[oid] = order
+                else:
+                    found.pop(oid, None)
+        result = sorted(found.items())
+        return result if limit is None else result[:limit]
+
+    def page(self, username=None, status=None, since=None, until=None, after=None, limit=None,
+             created_since=None, created_until=None):
+        """Keyset-paginated listing: orders with order_id > ``after``, at most ``limit`` of them.
+
+        ``since``/``until`` filter on delivery_time (inclusive/exclusive datetimes).
+        ``created_since``/``created_until`` filter on when the order was placed,
+        as a range scan of the time-ordered order ids; orders with ids from
+        before those ids existed are never in that range. Listed orders are
+        not added to the cache.
+        """
+        where, params = order_conditions(username, status, since, until, after, created_since, created_until)
+        return self.query(where, params, limit=limit, remember=False)
+
+    def iter_pages(self, username=None, status=None, since=None, until=None, batch_size=500,
+                   created_since=None, created_until=None):
+        """Yield every matching (order_id, order) while holding only one batch in memory."""
+        after = None
+        while True:
+            where, params = order_conditions(username, status, since, until, after, created_since, created_until)
+            batch = self.query(where, params, limit=batch_size, remember=False)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = batch[-1][0]
+
+    def for_user(self, username):
+        return self.query("username = ?", (username,))
+
+    def with_status(self, status):
+        return self.query("status = ?", (status,))
+
+    def delivering_between(self, start, end):
+        return self.query("delivery_time >= ? AND delivery_time < ?",
+                          (start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT)))
+
+    def items(self):
+        return self.query()
+
+    def keys(self):
+        return [oid for oid, _ in self.query()]
+
+    def values(self):
+        return [order for _, order in self.query()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.query())
+
+    def cache_stats(self):
+        with self._lock:
+            return {"cached": len(self._cache), "pending": len(self._dirty), "capacity": self._cache_size,
+                    "hits": self.hits, "misses": self.misses}
+
+    def has_changes(self):
+        return bool(self._dirty or self._deleted)
+
+    def remember(self, oid, order):
+        """Cache an order the caller has just written to SQLite itself (see write_order)."""
+        with self._lock:
+            order = self._wrap(oid, order)
+            self._deleted.discard(oid)
+            self._remember(oid, order)
+        return order
+
+    def pending_ids(self):
+        """Ids of orders with changes not yet written to SQLite."""
+        with self._lock:
+            return set(self._dirty) | self._deleted
+
+    def forget(self, oids):
+        """Drop these orders from the cache (they were moved out of the table)."""
+        with self._lock:
+            for oid in oids:
+                self._cache.pop(oid, None)
+
+    def invalidate(self):
+        """Forget cached orders (another process changed the table); unsaved ones are kept."""
+        with self._lock:
+            self._cache.clear()
+
+    def drain_changes(self):
+        with self._lock:
+            rows, deleted = self._dirty, self._deleted
+            self._dirty, self._deleted = {}, set()
+            self._flushing_inserted, self._inserted = self._inserted, set()
+            # Deleted rows stay hidden until the DELETE is committed
+            self._flushing_deleted |= deleted
+            for oid, order in rows.items():
+                self._remember(oid, order)
+        return rows, deleted
+
+    def restore_changes(self, rows, deleted):
+        with self._lock:
+            self._flushing_deleted -= deleted
+            for oid, order in rows.items():
+                if oid not in self._deleted:
+                    self._dirty.setdefault(oid, order)
+            self._inserted |= self._flushing_inserted & self._dirty.keys()
+            self._flushing_inserted = set()
+            self._deleted |= {oid for oid in deleted if oid not in self._dirty}
+
+    def changes_committed(self, rows, deleted):
+        with self._lock:
+            self._flushing_deleted -= deleted
+            self._flushing_inserted = set()
+
+    def discard_changes(self):
+        """Forget pending changes without writing them (a forked child; the parent flushes them).
+
+        Unsaved orders are dropped from the cache too, so they are read back
+        once the parent has written them.
+        """
+        self._lock = threading.RLock()
+        for oid in self._dirty:
+            self._cache.pop(oid, None)
+        self._dirty, self._deleted, self._inserted = {}, set(), set()
+        self._flushing_deleted, self._flushing_inserted = set(), set()
+
+    def flushing_inserted(self):
+        """Ids among the drained changes that were added with orders[oid] = ... rather than edited."""
+        with self._lock:
+            return set(self._flushing_inserted)
+
+
+def order_conditions(username=None, status=None, since=None, until=None, after=None,
+                      created_since=None, created_until=None):
+    clauses, params = [], []
+    if username is not None:
+        clauses.append("username = ?")
+        params.append(username)
+    if status is not None:
+        clauses.append("status = ?")
+        params.append(status)
+    if since is not None:
+        clauses.append("delivery_time >= ?")
+        params.append(since.strftime(DATE_FORMAT))
+    if until is not None:
+        clauses.append("delivery_time < ?")
+        params.append(until.strftime(DATE_FORMAT))
+    if after is not None:
+        clauses.append("order_id > ?")
+        params.append(after)
+    if created_since is not None or created_until is not None:
+        # Generated ids start with their creation time, so this is a primary key range scan
+        if created_since is not None:
+            clauses.append("order_id >= ?")
+            params.append(id_floor(created_since))
+        if created_until is not None:
+            clauses.append("order_id < ?")
+            params.append(id_floor(created_until))
+        clauses.append(f"length(order_id) = {ORDER_ID_LENGTH}")
+    return " AND ".join(clauses), tuple(params)
+
+def _match_pending(pending, where, params):
+    """Evaluate an orders WHERE clause against unflushed orders using an in-memory table."""
+    if not where:
+        return set(pending)
+    mem = sqlite3.connect(":memory:")
+    try:
+        mem.execute(f"CREATE TABLE orders ({_ORDER_COLUMNS})")
+        mem.executemany("INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?)",
+                        [_order_row(oid, order) for oid, order in pending.items()])
+        return {row[0] for row in mem.execute(f"SELECT order_id FROM orders WHERE {where}", params)}
+    finally:
+        mem.close()
+
+def _medicine_row(name, details):
+    return (name, details['price'], details['stock'])
+
+def _user_row(username, details):
+    return (username, details['password'].strip(), details['address'])
+
+def _order_row(oid, order):
+    return (oid, order['username'], _encode_items(order['items']), order['prescription'], order['status'], order['delivery_time'].strftime(DATE_FORMAT))
+
+# (table, key column, upsert statement, row builder) for each collection passed to save_data
+_TABLES = (
+    ("medicines", "name", "INSERT OR REPLACE INTO medicines (name, price, stock) VALUES (?, ?, ?)", _medicine_row),
+    ("users", "username", "INSERT OR REPLACE INTO users (username, password, address) VALUES (?, ?, ?)", _user_row),
+    ("orders", "order_id", "INSERT OR REPLACE INTO orders (order_id, username, items, prescription, status, delivery_time) VALUES (?, ?, ?, ?, ?, ?)", _order_row),
+)
+
+# Write-behind: when > 0, save_data only schedules a flush this many seconds later
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0"))
+
+_flush_lock = threading.Lock()
+_pending_lock = threading.Lock()
+_pending = None
+_flush_timer = None
+
+def _is_tracked(data):
+    return isinstance(data, (TrackedDict, OrderRepository))
+
+def _write_collection(c, table, key_col, upsert_sql, make_row, data):
+    if not _is_tracked(data):
+        # Untracked dict: upsert every row it holds; rows it doesn't hold are left alone
+        rows = dict(data)
+        c.executemany(upsert_sql, [make_row(k, v) for k, v in rows.items()])
+        return rows, set()
+    rows, deleted = data.drain_changes()
+    if deleted:
+        c.executemany(f"DELETE FROM {table} WHERE {key_col} = ?", [(k,) for k in deleted])
+    if rows and isinstance(data, OrderRepository):
+        _write_orders(c, data, upsert_sql, rows)
+    elif rows:
+        c.executemany(upsert_sql, [make_row(k, v) for k, v in rows.items()])
+    return rows, deleted
+
+def _write_orders(c, orders, upsert_sql, rows):
+    # Edited orders are only updated: another process may have cancelled or archived one since it
+    # was read, and writing it back would resurrect it. Those are dropped from ``rows`` and the cache.
+    inserted = orders.flushing_inserted()
+    c.executemany(upsert_sql, [_order_row(oid, order) for oid, order in rows.items() if oid in inserted])
+    gone = []
+    for oid, order in rows.items():
+        if oid not in inserted:
+            c.execute("UPDATE orders SET username = ?, items = ?, prescription = ?, status = ?, delivery_time = ? "
+                      "WHERE order_id = ?", _order_row(oid, order)[1:] + (oid,))
+            if c.rowcount == 0:
+                gone.append(oid)
+    for oid in gone:
+        del rows[oid]
+    orders.forget(gone)
+
+def _write_order_items(c, orders, changes, medicines):
+    written, deleted = changes[0].items(), changes[1]
+    if deleted:
+        c.executemany("DELETE FROM order_items WHERE order_id = ?", [(oid,) for oid in deleted])
+    lines = []
+    for oid, order in written:
+        for med, qty in order['items'].items():
+            # unit_price is captured the first time a line is written and kept on later updates
+            lines.append((oid, med, qty, medicines.get(med, {}).get('price')))
+    if lines:
+        c.executemany("INSERT INTO order_items (order_id, medicine, quantity, unit_price) VALUES (?, ?, ?, ?) "
+                      "ON CONFLICT (order_id, medicine) DO UPDATE SET quantity = excluded.quantity", lines)
+
+def write_order(conn, order_id, order):
+    """Insert a new order and its lines on the caller's connection and transaction.
+
+    Raises sqlite3.IntegrityError if the id is taken. Returns the bumped
+    versions; after commit, pass them to versions.written() and the order
+    to orders.remember().
+    """
+    conn.execute(f"INSERT INTO orders ({_ORDER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", _order_row(order_id, order))
+    _write_order_items(conn, orders, ({order_id: order}, ()), medicines)
+    return versions.bump_keys(conn, "orders", [order_id])
+
+def flush(medicines, users, orders, cart=None):
+    """Write every pending change of the collections in a single transaction.
+
+    ``cart`` is accepted for compatibility; the CartStore writes its own changes.
+    """
+    collections = (medicines, users, orders)
+    if not any(not _is_tracked(d) or d.has_changes() for d in collections):
+        return
+    with _flush_lock:
+        drained = []
+        with pool.connection() as conn:
+            try:
+                c = conn.cursor()
+                for (table, key_col, upsert_sql, make_row), data in zip(_TABLES, collections):
+                    drained.append((data, _write_collection(c, table, key_col, upsert_sql, make_row, data)))
+                _write_order_items(c, orders, drained[2][1], medicines)
+                # Tell other processes which rows to refresh
+                bumped = {}
+                for (table, *_), (data, changes) in zip(_TABLES, drained):
+                    if changes[0] or changes[1]:
+                        bumped.update(versions.bump_keys(c, table, set(changes[0]) | changes[1]))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                for data, changes in drained:
+                    if _is_tracked(data):
+                        data.restore_changes(*changes)
+                raise
+        for data, changes in drained:
+            if _is_tracked(data):
+                data.changes_committed(*changes)
+        versions.written(bumped)
+
+def _flush_pending():
+    global _pending, _flush_timer
+    with _pending_lock:
+        args, _pending, _flush_timer = _pending, None, None
+    if args is not None:
+        flush(*args)
+
+def flush_pending():
+    """Flush any write-behind batch immediately (also run at interpreter exit)."""
+    timer = _flush_timer
+    if timer is not None:
+        timer.cancel()
+    _flush_pending()
+
+atexit.register(flush_pending)
+
+def _after_fork():
+    # The parent still flushes whatever was pending at the fork; if the child wrote it too, its
+    # stale copy could later overwrite newer rows. The child starts with nothing to write.
+    global _flush_timer, _flush_lock, _pending_lock, _pending
+    _flush_lock = threading.Lock()
+    _pending_lock = threading.Lock()
+    _flush_timer = None
+    _pending = None
+    for collection in (medicines, users, orders):
+        collection.discard_changes()
+
+os.register_at_fork(after_in_child=_after_fork)
 
 def save_data(medicines, users, orders, cart):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    for med, details in medicines.items():
-        c.execute("INSERT OR REPLACE INTO medicines (name, price, stock) VALUES (?, ?, ?)", 
-                  (med, details['price'], details['stock']))
-    for user, details in users.items():
-        c.execute("INSERT OR REPLACE INTO users (username, password, address) VALUES (?, ?, ?)", 
-                  (user, details['password'].strip(), details['address']))
-    for oid, order in orders.items():
-        c.execute("INSERT OR REPLACE INTO orders (order_id, username, items, prescription, status, delivery_time) VALUES (?, ?, ?, ?, ?, ?)", 
-                  (oid, order['username'], str(order['items']), order['prescription'], order['status'], order['delivery_time'].strftime('%Y-%m-%d %H:%M:%S')))
-    c.execute("DELETE FROM cart")  # Clear cart and reinsert
-    for med, qty in cart.items():
-        c.execute("INSERT INTO cart (medicine, quantity) VALUES (?, ?)", (med, qty))
-    conn.commit()
-    conn.close()
+    if WRITE_BEHIND_INTERVAL <= 0:
+        flush(medicines, users, orders, cart)
+        return
+    global _pending, _flush_timer
+    with _pending_lock:
+        _pending = (medicines, users, orders, cart)
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(WRITE_BEHIND_INTERVAL, _flush_pending)
+            _flush_timer.daemon = True
+            _flush_timer.start()
 
-def load_data():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+def _select(conn, sql, key_col, keys=None):
+    # Every row, or only those with the given keys (in chunks below SQLite's variable limit)
+    if keys is None:
+        return conn.execute(sql).fetchall()
+    keys, rows = list(keys), []
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        rows += conn.execute(f"{sql} WHERE {key_col} IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+    return rows
+
+def _read_medicines(conn, names=None):
     # Fetch medicines and convert to dictionary with nested structure
-    medicines_data = c.execute("SELECT name, price, stock FROM medicines").fetchall()
-    medicines = {row[0]: {"price": row[1], "stock": row[2]} for row in medicines_data}
+    medicines_data = _select(conn, "SELECT name, price, stock FROM medicines", "name", names)
+    return {row[0]: {"price": row[1], "stock": row[2]} for row in medicines_data}
+
+def _read_users(conn, usernames=None):
     # Fetch users and convert to dictionary with nested structure
-    users_data = c.execute("SELECT username, password, address FROM users").fetchall()
+    users_data = _select(conn, "SELECT username, password, address FROM users", "username", usernames)
     users = {row[0]: {"password": str(row[1]).strip(), "address": row[2]} for row in users_data}
-    # Fetch orders and convert to dictionary with nested structure
-    orders_data = c.execute("SELECT order_id, username, items, prescription, status, delivery_time FROM orders").fetchall()
-    orders = {row[0]: {"username": row[1], "items": eval(row[2]), "prescription": row[3], "status": row[4], "delivery_time": datetime.strptime(row[5], '%Y-%m-%d %H:%M:%S')} for row in orders_data}
-    # Fetch cart and convert to dictionary
-    cart_data = c.execute("SELECT medicine, quantity FROM cart").fetchall()
-    cart = {row[0]: row[1] for row in cart_data}
-    conn.close()
-    return medicines, users, orders, cart
+    # is_admin isn't stored; the built-in admin account is the only administrator
+    if "admin" in users:
+        users["admin"]["is_admin"] = True
+    return users
+
+def sync():
+    """Bring this process's caches up to date with writes made by other processes.
+
+    Costs one ``PRAGMA data_version`` when nothing was committed elsewhere.
+    Medicines and users are refreshed in place, reading only the rows the
+    change log names (everything after bulk writes); the orders and carts
+    it names are dropped and read again on demand. Returns the collections refreshed.
+    Initializes the data layer on first use.
+    """
+    if not _initialized:
+        init()
+        return []
+    changed = versions.changed()
+    if "medicines" in changed or "users" in changed:
+        # Hold the flush lock so rows drained for an in-flight flush aren't mistaken for deletions
+        with _flush_lock, pool.connection() as conn:
+            for name, collection, read in (("medicines", medicines, _read_medicines), ("users", users, _read_users)):
+                if name in changed:
+                    keys = versions.changed_keys(conn, name, *changed[name])
+                    collection.reload(read(conn, keys), keys)
+    if "orders" in changed or "cart" in changed:
+        with pool.connection() as conn:
+            for name, store in (("orders", orders), ("cart", cart)):
+                if name in changed:
+                    keys = versions.changed_keys(conn, name, *changed[name])
+                    if keys is None:
+                        store.invalidate()
+                    else:
+                        store.forget(keys)
+    return list(changed)
+
+def reload_catalog():
+    """Re-read the medicines table into the in-memory catalog after writes made straight to SQLite."""
+    with _flush_lock, pool.connection() as conn:
+        return medicines.reload(_read_medicines(conn))
 
 def generate_order_id():
-    return str(uuid.uuid4())[:8]
+    """A new time-ordered order id (see order_ids.OrderIdGenerator) that no stored order uses yet."""
+    order_id = order_ids.next_id()
+    # Skips ids already stored; one can still be taken before it is written, see place_with_fresh_id
+    while order_id in orders:
+        order_id = order_ids.next_id()
+    return order_id
+
+# New ids tried by place_with_fresh_id before the collision is reported
+ORDER_ID_ATTEMPTS = 5
+
+def place_with_fresh_id(place):
+    """Call ``place(order_id)`` with a new id until write_order doesn't find it taken.
+
+    ``place`` must undo its writes when write_order raises (running it in
+    one transaction does). Returns (order_id, result); after
+    ORDER_ID_ATTEMPTS taken ids the sqlite3.IntegrityError is re-raised.
+    """
+    for attempt in range(ORDER_ID_ATTEMPTS):
+        order_id = generate_order_id()
+        try:
+            return order_id, place(order_id)
+        except sqlite3.IntegrityError as e:
+            if "orders.order_id" not in str(e) or attempt == ORDER_ID_ATTEMPTS - 1:
+                raise
 
 def calculate_delivery_time():
     # Set delivery time based on 3:00 PM IST cutoff
@@ -89,22 +902,32 @@ def calculate_delivery_time():
         delivery_time += timedelta(days=1)
     return delivery_time
 
+DELIVERY_FEE = 417.5  # $5 * 83.5 = ₹417.5
+
 def calculate_total_cost(items, medicines):
     total = 0
     for med, qty in items.items():
-        if med in medicines and medicines[med]["stock"] >= qty:
+        # Availability is enforced when stock is reserved; held units no longer show as stock here
+        if med in medicines:
             total += medicines[med]["price"] * qty
-    delivery_fee = 417.5  # $5 * 83.5 = ₹417.5
-    return total + delivery_fee
-
-# Initialize database on import
-init_db()
-medicines, users, orders, cart = load_data()
-
-# Ensure there is at least one admin user for admin login
-if 'admin' not in users:
-    users['admin'] = {'password': 'admin123', 'address': 'Admin Panel', 'is_admin': True}
-    save_data(medicines, users, orders, cart)
-else:
-    users['admin']['is_admin'] = True
-    save_data(medicines, users, orders, cart)
\ No newline at end of file
+    return total + DELIVERY_FEE
+
+def order_totals(order_ids):
+    """Return {order_id: total} from the prices captured in order_items, delivery fee included.
+
+    Orders without stored lines (not written yet) are left out.
+    """
+    order_ids, totals = list(order_ids), {}
+    with pool.connection() as conn:
+        for i in range(0, len(order_ids), 500):
+            chunk = order_ids[i:i + 500]
+            totals.update(conn.execute("SELECT order_id, SUM(quantity * COALESCE(unit_price, 0)) FROM order_items "
+                                       f"WHERE order_id IN ({', '.join('?' * len(chunk))}) GROUP BY order_id",
+                                       chunk).fetchall())
+    return {oid: round(total + DELIVERY_FEE, 2) for oid, total in totals.items()}
+
+# Shared collections start empty; init() creates the schema and fills them
+versions = VersionTracker(pool)
+medicines, users = TrackedDict(), TrackedDict()
+orders = OrderRepository(pool, cache_size=ORDER_CACHE_SIZE)
+cart = CartStore(pool, versions=versions)
\ No newline at end of file
@@ -0,0 +1,126 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Pragmas applied to every new connection; values can be overridden from the environment
+DEFAULT_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-16000")),    # negative = KiB, i.e. 16 MB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", "268435456")),   # 256 MB
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),  # ms
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+
+class ConnectionPool:
+    """A bounded pool of SQLite connections shared by all threads.
+
+    Connections are created lazily up to ``size``; once the pool is exhausted
+    callers wait (up to ``timeout`` seconds) for one to be returned. Any
+    transaction left open by a caller is rolled back before the connection
+    goes back into the pool.
+    """
+
+    def __init__(self, path, size=8, pragmas=None, timeout=30.0, factory=sqlite3.Connection):
+        self.path = path
+        self.size = size
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.timeout = timeout
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._in_use = 0
+        self._acquires = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=self.factory,
+                               timeout=self.pragmas.get("busy_timeout", 5000) / 1000)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections must not be shared with a forked child
+                self._reset()
+            self._acquires += 1
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                if len(self._all) < self.size:
+                    conn = self._connect()
+                    self._all.append(conn)
+            if conn is not None:
+                self._in_use += 1
+                return conn
+            self._waits += 1
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"timed out waiting for a connection to {self.path}")
+        with self._lock:
+            self._wait_time += time.perf_counter() - started
+            self._in_use += 1
+        return conn
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+            stale = conn not in self._all
+        if stale:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of the ``with`` block."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def dedicated(self):
+        """Open a connection outside the pool with the same pragmas; the caller owns and closes it."""
+        return self._connect()
+
+    def close_all(self):
+        with self._lock:
+            conns, self._all = self._all, []
+            self._idle = queue.LifoQueue()
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "size": self.size,
+                "open": len(self._all),
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "acquires": self._acquires,
+                "waits": self._waits,
+                "wait_time_s": round(self._wait_time, 6),
+                "pragmas": dict(self.pragmas),
+            }
@@ -0,0 +1,416 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from data_storage import medicines
+from metrics import registry
+from medicine_matcher import get_matcher, catalog_names_version
+
+MODEL_NAME = "gemini-2.0-flash-exp"
+# Extraction results are cached per (normalized OCR text, catalog version)
+EXTRACT_CACHE_SIZE = int(os.getenv("EXTRACT_CACHE_SIZE", "1024"))
+EXTRACT_CACHE_TTL = float(os.getenv("EXTRACT_CACHE_TTL", "600"))
+# Send at most this many locally shortlisted catalog names to the model (0 = always send the full catalog)
+EXTRACT_SHORTLIST_K = int(os.getenv("EXTRACT_SHORTLIST_K", "50"))
+# The shortlist is only trusted if its best candidate scores at least this much
+EXTRACT_SHORTLIST_MIN_SCORE = float(os.getenv("EXTRACT_SHORTLIST_MIN_SCORE", "0.75"))
+# Seconds to wait for the model before answering with the local matcher's result
+EXTRACT_DEADLINE = float(os.getenv("EXTRACT_DEADLINE", "8"))
+# Consecutive failures/timeouts that open the circuit, and seconds before a half-open probe
+EXTRACT_BREAKER_FAILURES = int(os.getenv("EXTRACT_BREAKER_FAILURES", "5"))
+EXTRACT_BREAKER_RESET = float(os.getenv("EXTRACT_BREAKER_RESET", "30"))
+# Threads available for in-flight model calls; also the cap on concurrent model calls
+EXTRACT_UPSTREAM_WORKERS = int(os.getenv("EXTRACT_UPSTREAM_WORKERS", "8"))
+# Worker threads and maximum item count for /extract_medicines_batch
+EXTRACT_BATCH_WORKERS = int(os.getenv("EXTRACT_BATCH_WORKERS", "4"))
+EXTRACT_BATCH_MAX = int(os.getenv("EXTRACT_BATCH_MAX", "100"))
+
+SYSTEM_PROMPT = (
+    "You extract medicine names from the provided OCR text. "
+    "Only return medicines that exist in the provided 'allowed_medicines' list. "
+    "Ignore non-medicine words, numbers, headers (like Medicines:, Name:, Age:). "
+    "Return a compact JSON array of strings with exact values from allowed_medicines. No extra text."
+)
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire ``ttl`` seconds after insertion."""
+
+    def __init__(self, maxsize=1024, ttl=600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl_s": self.ttl,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class CircuitBreaker:
+    """Stops calling a failing dependency for a while, then lets one probe through.
+
+    closed: calls allowed; ``failure_threshold`` consecutive failures open it.
+    open: calls refused until ``reset_timeout`` seconds have passed.
+    half_open: a single probe call is allowed; success closes, failure re-opens.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def release_probe(self):
+        # An allowed call was abandoned before reaching the dependency
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self._failures, "rejected": self.rejected}
+
+
+_cache = TTLCache(EXTRACT_CACHE_SIZE, EXTRACT_CACHE_TTL)
+_flight = SingleFlight()
+_breaker = CircuitBreaker(EXTRACT_BREAKER_FAILURES, EXTRACT_BREAKER_RESET)
+_upstream_pool = ThreadPoolExecutor(max_workers=EXTRACT_UPSTREAM_WORKERS, thread_name_prefix="gemini")
+# A slot is held from submit until the model call finishes, so hung calls can't pile up in the pool queue
+_model_slots = threading.BoundedSemaphore(EXTRACT_UPSTREAM_WORKERS)
+_batch_pool = ThreadPoolExecutor(max_workers=EXTRACT_BATCH_WORKERS, thread_name_prefix="extract-batch")
+_model_lock = threading.Lock()
+_model = None
+_model_api_key = None
+_injected_model = None
+_upstream_calls = 0
+_upstream_calls_lock = threading.Lock()
+# The Gemini SDK is slow to import, so it is loaded on the first model call
+genai = None
+_genai_loaded = False
+_extract_seconds = registry.histogram("extraction_seconds", "Prescription extraction time by result source "
+                                      "(gemini, fallback, error_fallback, or cache)", ("source",))
+_model_seconds = registry.histogram("gemini_call_seconds", "Gemini generate_content latency by outcome",
+                                    ("outcome",))
+
+
+def fuzzy_detect(text):
+    """Fallback detection using the precompiled catalog matcher if Gemini is unavailable."""
+    # The matcher may still be the one compiled before a medicine was removed
+    return [name for name in get_matcher().detect(text) if name in medicines]
+
+
+def _load_genai():
+    global genai, _genai_loaded
+    if not _genai_loaded:
+        try:
+            import google.generativeai as sdk
+        except Exception:  # library may not be installed yet during initial run
+            sdk = None
+        genai, _genai_loaded = sdk, True
+    return genai
+
+
+def _get_model(api_key):
+    # Configure the SDK and build the client once; rebuild only if the key changes
+    global _model, _model_api_key
+    with _model_lock:
+        if _model is None or _model_api_key != api_key:
+            genai.configure(api_key=api_key)
+            _model = genai.GenerativeModel(f"models/{MODEL_NAME}")
+            _model_api_key = api_key
+        return _model
+
+
+def set_model(model):
+    """Use ``model`` (any object with generate_content) instead of the Gemini SDK.
+
+    Meant for tests and benchmarks; pass None to go back to the configured SDK client.
+    """
+    global _injected_model
+    _injected_model = model
+
+
+def _current_model():
+    if _injected_model is not None:
+        return _injected_model
+    api_key = os.getenv("api_key")
+    if not api_key or _load_genai() is None:
+        return None
+    return _get_model(api_key)
+
+
+def _parse_detected(raw):
+    # try to extract JSON array
+    start = raw.find('[')
+    end = raw.rfind(']')
+    detected = []
+    if start != -1 and end != -1 and end > start:
+        detected = json.loads(raw[start:end + 1])
+    if not isinstance(detected, list):
+        detected = []
+    # Filter to catalog names to be safe
+    return [d for d in detected if isinstance(d, str) and d in medicines]
+
+
+def allowed_medicines(text):
+    """Catalog names to offer the model for ``text`` and whether they are a shortlist.
+
+    A local pre-pass over the OCR text picks the top EXTRACT_SHORTLIST_K
+    plausible names. If it finds nothing convincing the full catalog is
+    sent, so the model can still catch what the matcher missed.
+    """
+    if 0 < EXTRACT_SHORTLIST_K < len(medicines):
+        ranked = get_matcher().shortlist(text, EXTRACT_SHORTLIST_K)
+        if ranked and ranked[0][1] >= EXTRACT_SHORTLIST_MIN_SCORE:
+            return [name for name, _ in ranked if name in medicines], True
+    return list(medicines.keys()), False
+
+
+def _call_model(model, parts):
+    # Timed on the upstream thread, so calls that outlive the deadline are still measured
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        resp = model.generate_content(parts)
+        outcome = "ok"
+        return resp
+    finally:
+        _model_seconds.observe(time.perf_counter() - started, outcome)
+
+
+def run_extraction(text, deadline=None):
+    """Detect medicines in OCR text with Gemini, falling back to the local matcher.
+
+    The model call runs on a worker thread while the local matcher runs
+    here; if the model has not answered within ``deadline`` seconds (default
+    EXTRACT_DEADLINE) the local result is returned instead. Failures and
+    timeouts feed a circuit breaker that skips the model entirely while open.
+    """
+    global _upstream_calls
+    started = time.monotonic()
+    deadline = EXTRACT_DEADLINE if deadline is None else deadline
+    try:
+        model = _current_model()
+    except Exception as e:
+        return {"detected": fuzzy_detect(text), "source": "error_fallback", "model": None, "error": str(e)}
+    if model is None:
+        return {"detected": fuzzy_detect(text), "source": "fallback", "model": None}
+    if not _breaker.allow():
+        return {"detected": fuzzy_detect(text), "source": "error_fallback", "model": None, "error": "circuit_open"}
+    try:
+        allowed, shortlisted = allowed_medicines(text)
+        prompt = (
+            f"allowed_medicines = {json.dumps(allowed)}\n\n"
+            f"ocr_text = '''\n{text}\n'''\n\n"
+            "Respond with JSON array only, e.g., [\"Paracetamol\", \"Ibuprofen\"]."
+        )
+        prompt_info = {"chars": len(SYSTEM_PROMPT) + len(prompt), "allowed_medicines": len(allowed),
+                       "catalog_size": len(medicines), "shortlisted": shortlisted}
+    except Exception as e:
+        # Nothing reached the model; don't leave a half-open breaker waiting on a probe that never ran
+        _breaker.release_probe()
+        return {"detected": fuzzy_detect(text), "source": "error_fallback", "model": None, "error": str(e)}
+    if not _model_slots.acquire(timeout=max(0.0, deadline - (time.monotonic() - started))):
+        # Saturated locally, not an upstream failure: don't count it against the breaker
+        _breaker.release_probe()
+        return {"detected": fuzzy_detect(text), "source": "error_fallback", "model": None, "error": "model_busy"}
+    try:
+        with _upstream_calls_lock:
+            _upstream_calls += 1
+        future = _upstream_pool.submit(_call_model, model, [SYSTEM_PROMPT, prompt])
+    except Exception as e:
+        _model_slots.release()
+        _breaker.record_failure()
+        return {"detected": fuzzy_detect(text), "source": "error_fallback", "model": None, "error": str(e)}
+    future.add_done_callback(lambda _: _model_slots.release())
+    # Hedge: compute the local answer while the model call is in flight
+    local = fuzzy_detect(text)
+    try:
+        resp = future.result(timeout=max(0.0, deadline - (time.monotonic() - started)))
+    except FutureTimeout:
+        _breaker.record_failure()
+        return {"detected": local, "source": "error_fallback", "model": None,
+                "error": f"deadline of {deadline}s exceeded", "prompt": prompt_info}
+    except Exception as e:
+        _breaker.record_failure()
+        return {"detected": local, "source": "error_fallback", "model": None, "error": str(e)}
+    _breaker.record_success()
+    try:
+        raw = resp.text.strip() if hasattr(resp, 'text') else ''
+        detected = _parse_detected(raw)
+    except Exception as e:
+        return {"detected": local, "source": "error_fallback", "model": None, "error": str(e)}
+    # If empty, use the local matcher as a safety net
+    if not detected:
+        detected = local
+    return {"detected": detected, "source": "gemini", "model": MODEL_NAME, "prompt": prompt_info}
+
+
+def cache_key(text):
+    return (" ".join(text.lower().split()), catalog_names_version())
+
+
+def extract(text):
+    """Cached, coalesced run_extraction.
+
+    Identical OCR text (ignoring case and whitespace) against the same
+    catalog is answered from the cache, and concurrent identical requests
+    share a single upstream call. Error fallbacks are not cached.
+    """
+    started = time.perf_counter()
+    key = cache_key(text)
+    result = _cache.get(key)
+    if result is not None:
+        _extract_seconds.observe(time.perf_counter() - started, "cache")
+        return dict(result, cached=True)
+
+    def compute():
+        result = run_extraction(text)
+        if result["source"] != "error_fallback":
+            _cache.set(key, result)
+        return result
+
+    result = _flight.do(key, compute)
+    _extract_seconds.observe(time.perf_counter() - started, result["source"])
+    return dict(result, cached=False)
+
+
+def _timed_extract(text):
+    started = time.perf_counter()
+    result = extract(text)
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def extract_batch(texts):
+    """Run extract() for many OCR texts on the batch worker pool.
+
+    Results come back in input order. Texts that normalize to the same
+    cache key are extracted once and the copies are marked ``duplicate``.
+    Empty texts get an ``empty_text`` error entry instead of failing the batch.
+    """
+    futures = {}
+    plan = []
+    for text in texts:
+        if not text.strip():
+            plan.append(None)
+            continue
+        key = cache_key(text)
+        duplicate = key in futures
+        if not duplicate:
+            futures[key] = _batch_pool.submit(_timed_extract, text)
+        plan.append((key, duplicate))
+    results = []
+    for index, entry in enumerate(plan):
+        if entry is None:
+            results.append({"index": index, "detected": [], "error": "empty_text"})
+            continue
+        key, duplicate = entry
+        item = dict(futures[key].result(), index=index)
+        if duplicate:
+            item["duplicate"] = True
+            item["latency_ms"] = 0.0
+        results.append(item)
+    return results
+
+
+def extraction_stats():
+    return {"cache": _cache.stats(), "coalesced": _flight.coalesced, "upstream_calls": _upstream_calls,
+            "circuit": _breaker.stats()}
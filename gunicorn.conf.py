@@ -0,0 +1,21 @@
+# Multi-process launch: gunicorn -c gunicorn.conf.py server:app
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+# Import the app once in the master; workers start their job threads on their first request
+preload_app = True
+
+
+def on_starting(server):
+    # Create and migrate the schema once, before any worker is forked
+    from data_storage import init
+    init()
+
+
+def pre_fork(server, worker):
+    # Write any write-behind batch first so the new worker doesn't start from rows the master hasn't saved
+    from data_storage import flush_pending
+    flush_pending()
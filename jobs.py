@@ -0,0 +1,259 @@
+import base64
+import io
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from data_storage import pool, init, on_init
+from extraction import extract
+from metrics import registry
+
+try:
+    import pytesseract
+    from PIL import Image
+except Exception:  # server-side OCR is optional; the web UI runs Tesseract.js in the browser
+    pytesseract = None
+    Image = None
+
+# Worker threads per process, attempts before a job is marked failed, and how long a
+# running job may go without progress before another worker takes it over
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300"))
+# Idle workers re-check the table this often (picks up jobs submitted by other processes)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# Finished jobs (done or failed) are deleted this many seconds after their last update; 0 keeps them
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+# Longest pause after repeated worker errors (e.g. "database is locked"); the pause doubles from JOB_POLL_INTERVAL
+JOB_ERROR_BACKOFF_MAX = float(os.getenv("JOB_ERROR_BACKOFF_MAX", "30"))
+
+FINAL_STATES = ("done", "failed")
+
+_worker_errors = registry.counter("job_worker_errors_total", "Errors that interrupted a job worker's loop")
+
+
+def init_jobs_table(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                    (job_id TEXT PRIMARY KEY, kind TEXT, payload BLOB, status TEXT, stage TEXT, owner TEXT,
+                     attempts INTEGER DEFAULT 0, result TEXT, error TEXT, created_at REAL, updated_at REAL)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+    conn.commit()
+
+
+def ocr_image(data):
+    """Server-side OCR stage for image jobs (needs pytesseract and Pillow)."""
+    if pytesseract is None:
+        raise RuntimeError("server-side OCR unavailable: install pytesseract and Pillow")
+    return pytesseract.image_to_string(Image.open(io.BytesIO(data)))
+
+
+class JobQueue:
+    """Prescription-processing jobs persisted in the ``jobs`` table.
+
+    Jobs move queued -> running -> done/failed, with ``stage`` reporting
+    progress inside a run (ocr, extracting). Workers claim jobs with a
+    single conditional UPDATE, so several threads or processes can share
+    the table. Jobs left running by a process that is no longer alive are
+    re-queued on startup (or, for other hosts, once they go stale) until
+    JOB_MAX_ATTEMPTS is reached.
+    """
+
+    def __init__(self, pool, workers=JOB_WORKERS):
+        self._pool = pool
+        self._workers = workers
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self.last_error = None
+
+    def start(self):
+        if self._threads and self._pid == os.getpid():
+            return
+        init()
+        with self._start_lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            # Threads don't survive a fork; a forked child starts its own
+            self._threads = []
+            self._pid = os.getpid()
+            self.requeue_orphaned()
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._stopping.clear()
+
+    def submit(self, kind, payload):
+        if kind not in ("text", "image"):
+            raise ValueError(f"unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._pool.connection() as conn:
+            conn.execute("INSERT INTO jobs (job_id, kind, payload, status, stage, attempts, created_at, updated_at) "
+                         "VALUES (?, ?, ?, 'queued', 'queued', 0, ?, ?)", (job_id, kind, payload, now, now))
+            conn.commit()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with self._pool.connection() as conn:
+            row = conn.execute("SELECT job_id, kind, status, stage, attempts, result, error, created_at, updated_at "
+                               "FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {"job_id": row[0], "kind": row[1], "status": row[2], "stage": row[3], "attempts": row[4],
+                "result": json.loads(row[5]) if row[5] else None, "error": row[6],
+                "created_at": row[7], "updated_at": row[8]}
+
+    def requeue_orphaned(self):
+        """Re-queue running jobs whose worker process on this host has exited."""
+        with self._pool.connection() as conn:
+            rows = conn.execute("SELECT job_id, owner FROM jobs WHERE status = 'running'").fetchall()
+        orphaned = [job_id for job_id, owner in rows if not _owner_alive(owner)]
+        return self._requeue(orphaned)
+
+    def requeue_stale(self, older_than):
+        """Re-queue running jobs that have made no progress for ``older_than`` seconds."""
+        cutoff = time.time() - older_than
+        with self._pool.connection() as conn:
+            rows = conn.execute("SELECT job_id FROM jobs WHERE status = 'running' AND updated_at <= ?",
+                                (cutoff,)).fetchall()
+        return self._requeue([row[0] for row in rows])
+
+    def _requeue(self, job_ids):
+        if not job_ids:
+            return 0
+        now = time.time()
+        with self._pool.connection() as conn:
+            conn.executemany("UPDATE jobs SET status = 'failed', stage = 'failed', error = 'too many attempts', "
+                             "payload = NULL, updated_at = ? WHERE job_id = ? AND status = 'running' AND attempts >= ?",
+                             [(now, job_id, JOB_MAX_ATTEMPTS) for job_id in job_ids])
+            conn.executemany("UPDATE jobs SET status = 'queued', stage = 'queued', owner = NULL, updated_at = ? "
+                             "WHERE job_id = ? AND status = 'running'", [(now, job_id) for job_id in job_ids])
+            conn.commit()
+        return len(job_ids)
+
+    def purge_finished(self, older_than=JOB_RETENTION_SECONDS):
+        """Delete done and failed jobs last updated more than ``older_than`` seconds ago; returns how many."""
+        with self._pool.connection() as conn:
+            deleted = conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at <= ?",
+                                   (time.time() - older_than,)).rowcount
+            conn.commit()
+        return deleted
+
+    def stats(self):
+        with self._pool.connection() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"workers": len(self._threads), "jobs": counts, "last_error": self.last_error}
+
+    def _claim(self):
+        with self._pool.connection() as conn:
+            row = conn.execute("UPDATE jobs SET status = 'running', stage = 'starting', owner = ?, "
+                               "attempts = attempts + 1, updated_at = ? WHERE job_id = (SELECT job_id FROM jobs "
+                               "WHERE status = 'queued' ORDER BY created_at LIMIT 1) AND status = 'queued' "
+                               "RETURNING job_id, kind, payload", (_owner(), time.time())).fetchone()
+            conn.commit()
+        return row
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._pool.connection() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+            conn.commit()
+
+    def _process(self, job_id, kind, payload):
+        if kind == "image":
+            self._update(job_id, stage="ocr")
+            text = ocr_image(payload)
+        else:
+            text = payload.decode("utf-8") if isinstance(payload, bytes) else payload
+        self._update(job_id, stage="extracting")
+        result = extract(text)
+        result["text"] = text
+        return result
+
+    def _run(self):
+        last_stale_check = time.monotonic()
+        backoff = 0
+        while not self._stopping.is_set():
+            try:
+                if time.monotonic() - last_stale_check > JOB_STALE_SECONDS:
+                    last_stale_check = time.monotonic()
+                    self.requeue_stale(JOB_STALE_SECONDS)
+                    if JOB_RETENTION_SECONDS > 0:
+                        self.purge_finished()
+                worked = self._run_one()
+            except Exception as e:
+                # A transient SQLite error must not end the thread. A job whose final write was lost
+                # stays running and is re-queued once it goes stale.
+                _worker_errors.inc()
+                self.last_error = f"{type(e).__name__}: {e}"
+                backoff = min(backoff * 2 or JOB_POLL_INTERVAL, JOB_ERROR_BACKOFF_MAX)
+                self._stopping.wait(backoff)
+                continue
+            backoff = 0
+            if not worked:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _run_one(self):
+        # Claim and process one job; False if none was queued
+        job = self._claim()
+        if job is None:
+            return False
+        job_id, kind, payload = job
+        # The upload is dropped once the job is finished; only the result is kept
+        try:
+            result = self._process(job_id, kind, payload)
+        except Exception as e:
+            self._update(job_id, status="failed", stage="failed", error=str(e), payload=None)
+        else:
+            self._update(job_id, status="done", stage="done", result=json.dumps(result), payload=None)
+        return True
+
+
+def _owner():
+    # Computed per call: a preloaded server may fork workers after import
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    # Only processes on this host can be checked; others are left to the stale timeout
+    host, _, pid = (owner or "").rpartition(":")
+    if not pid.isdigit():
+        return False
+    if host != socket.gethostname():
+        return True
+    if int(pid) == os.getpid():
+        return False  # left over from a previous run that reused our pid; we have no workers yet
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def decode_image(data):
+    """Accept raw base64 or a data: URL from the browser."""
+    if "," in data and data.startswith("data:"):
+        data = data.split(",", 1)[1]
+    return base64.b64decode(data, validate=True)
+
+
+on_init(init_jobs_table)
+job_queue = JobQueue(pool)
@@ -1,12 +1,12 @@
 from user_operation import register, login, add_to_cart, place_order, date_of_arrival, search_medicines, cancel_order, view_cart, upload_prescription_photo
 from admin_operation import admin_menu
 from getpass import getpass
-from data_storage import save_data, medicines, users, orders, cart, init_db
+from data_storage import save_data, medicines, users, orders, cart, init
 import webbrowser
 
 def main():
-    # Initialize the database on program start
-    init_db()
+    # Initialize the database and load the catalog on program start
+    init()
     
     while True:
         print("\nOnline Drug Delivery System")
@@ -35,7 +35,7 @@ def main():
                         if user_choice == 1:
                             search_medicines()
                         elif user_choice == 2:
-                            add_to_cart()
+                            add_to_cart(username)
                         elif user_choice == 3:
                             place_order(username)
                         elif user_choice == 4:
@@ -46,7 +46,7 @@ def main():
                             save_data(medicines, users, orders, cart)
                             break
                         elif user_choice == 7:
-                            view_cart()
+                            view_cart(username)
                         elif user_choice == 8:
                             upload_prescription_photo()
                         else:
@@ -0,0 +1,255 @@
+import difflib
+import os
+import re
+import threading
+from collections import Counter, deque
+
+from catalog_search import trigrams
+from data_storage import medicines
+
+# Same similarity threshold the difflib fallback has always used
+FUZZY_CUTOFF = 0.82
+# Single OCR tokens shorter than this are not fuzzy-matched (too many false positives)
+MIN_TOKEN_LENGTH = 4
+# Longest phrase (in words) compared against multi-word catalog names
+MAX_PHRASE_WORDS = 3
+# Candidates verified with difflib per phrase, and postings larger than this are skipped when rarer ones exist
+MAX_CANDIDATES = 8
+MAX_POSTING = 2000
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_NON_ALPHA = re.compile(r"[^a-z]+")
+
+
+def normalize(text):
+    return " ".join(_NON_ALNUM.sub(" ", text.lower()).split())
+
+
+class _AhoCorasick:
+    """Multi-pattern automaton: one pass over the text finds every pattern.
+
+    Only whole-word occurrences count, so "Insulin" is not reported inside
+    some longer word; near misses are left to the fuzzy pass.
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for pattern, value in patterns.items():
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] = self._out[state] + ((value, len(pattern)),)
+        # Breadth-first pass to set failure links and merge outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text):
+        found = set()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        last = len(text) - 1
+        for end, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state] and (end == last or text[end + 1] == " "):
+                for value, length in out[state]:
+                    start = end - length + 1
+                    if start == 0 or text[start - 1] == " ":
+                        found.add(value)
+        return found
+
+
+class MedicineMatcher:
+    """Detects catalog medicines in OCR text; compiled once per catalog.
+
+    Exact (case- and punctuation-insensitive) occurrences of any name,
+    including multi-word names, are found in a single Aho-Corasick pass.
+    Typos are handled by looking up each OCR token, and each run of up to
+    MAX_PHRASE_WORDS tokens, in a trigram index of names with the same word
+    count and confirming the best few candidates with difflib. The work
+    therefore grows with the length of the text, not with the catalog.
+    """
+
+    def __init__(self, names, version=0):
+        self.version = version
+        self._names = frozenset(names)
+        by_norm = {}
+        for name in self._names:
+            norm = normalize(name)
+            if norm:
+                by_norm.setdefault(norm, name)
+        self._exact = _AhoCorasick(by_norm)
+        self._by_norm = by_norm
+        self._max_words = 1
+        self._postings = {}  # (word count, trigram) -> set of normalized names
+        for norm in by_norm:
+            words = norm.count(" ") + 1
+            self._max_words = max(self._max_words, min(words, MAX_PHRASE_WORDS))
+            for gram in trigrams(norm):
+                self._postings.setdefault((words, gram), set()).add(norm)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def detect(self, text):
+        found = self._exact.find(normalize(text))
+        for n, phrase in self._phrases(text):
+            ranked = self._rank(n, phrase, FUZZY_CUTOFF)
+            if ranked:
+                found.add(self._by_norm[ranked[0][0]])
+        return sorted(found)
+
+    def shortlist(self, text, limit, floor=0.6):
+        """Rank catalog names that plausibly occur in ``text``, best first.
+
+        Returns up to ``limit`` (name, score) pairs: exact hits score 1.0,
+        fuzzy hits their difflib ratio (kept down to ``floor``, below the
+        detection cutoff, so the caller can hand near misses to the model).
+        """
+        scores = {name: 1.0 for name in self._exact.find(normalize(text))}
+        for n, phrase in self._phrases(text):
+            for norm, ratio in self._rank(n, phrase, floor):
+                name = self._by_norm[norm]
+                if ratio > scores.get(name, 0.0):
+                    scores[name] = ratio
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+    def _phrases(self, text):
+        tokens = _NON_ALPHA.sub(" ", text.lower()).split()
+        phrases = set()
+        for i in range(len(tokens)):
+            for n in range(1, self._max_words + 1):
+                if i + n > len(tokens):
+                    break
+                phrase = " ".join(tokens[i:i + n])
+                if n > 1 or len(phrase) >= MIN_TOKEN_LENGTH:
+                    phrases.add((n, phrase))
+        return phrases
+
+    def _rank(self, words, phrase, floor):
+        # Best few same-word-count names for a phrase with difflib ratio >= floor, best first
+        grams = trigrams(phrase)
+        postings = sorted((self._postings[(words, g)] for g in grams if (words, g) in self._postings), key=len)
+        if not postings:
+            return []
+        counts = Counter()
+        for names in postings:
+            if counts and len(names) > MAX_POSTING:
+                break
+            counts.update(names)
+        ranked = []
+        matcher = difflib.SequenceMatcher(b=phrase, autojunk=False)
+        for norm, _ in counts.most_common(MAX_CANDIDATES):
+            matcher.set_seq1(norm)
+            if matcher.real_quick_ratio() < floor or matcher.quick_ratio() < floor:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= floor:
+                ranked.append((norm, ratio))
+        ranked.sort(key=lambda item: -item[1])
+        return ranked
+
+
+_lock = threading.Lock()
+_matcher = None
+_version = 0
+_rebuilding = False
+_known_names = set(medicines.keys())
+
+
+def get_matcher():
+    """Return the matcher for the catalog.
+
+    Only the very first call compiles synchronously. After a catalog change
+    the previous matcher keeps being returned while a background thread
+    compiles the new one, so callers never wait on a rebuild; it can miss
+    medicines added since, and may report removed ones (callers check
+    names against the catalog).
+    """
+    global _matcher
+    matcher = _matcher
+    if matcher is None:
+        with _lock:
+            if _matcher is None:
+                _matcher = MedicineMatcher(list(medicines.keys()), _version)
+            matcher = _matcher
+    elif matcher.version != _version:
+        _start_rebuild()
+    return matcher
+
+
+def _start_rebuild():
+    global _rebuilding
+    with _lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+    threading.Thread(target=_rebuild, name="matcher-rebuild", daemon=True).start()
+
+
+def _rebuild():
+    # Compiled off the lock; a change made meanwhile is picked up by the next get_matcher() call
+    global _matcher, _rebuilding
+    try:
+        # Taken before the names: a change after this leaves the matcher stale, so it gets rebuilt
+        with _lock:
+            version = _version
+        matcher = MedicineMatcher(list(medicines.keys()), version)
+        with _lock:
+            _matcher = matcher
+    finally:
+        with _lock:
+            _rebuilding = False
+
+
+def invalidate():
+    global _version
+    with _lock:
+        _version += 1
+
+
+def catalog_names_version():
+    """Catalog version the matcher being served was compiled from; changes when a rebuilt one is swapped in."""
+    matcher = _matcher
+    return _version if matcher is None else matcher.version
+
+
+def _after_fork():
+    # A rebuild thread doesn't survive a fork; the child starts its own on the next call
+    global _lock, _rebuilding
+    _lock = threading.Lock()
+    _rebuilding = False
+
+
+def _on_catalog_change(name):
+    # Stock and price edits don't affect matching; only membership changes do
+    present = dict.__contains__(medicines, name)
+    if (name in _known_names) != present:
+        if present:
+            _known_names.add(name)
+        else:
+            _known_names.discard(name)
+        invalidate()
+
+
+medicines.subscribe(_on_catalog_change)
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,274 @@
+import bisect
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Set METRICS_ENABLED=0 to turn every metric into a no-op and skip the timing hooks
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Upper bounds in seconds; the +Inf bucket is implied
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values]
+        return lines
+
+
+class Histogram:
+    """Latency histogram per label combination, in seconds."""
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, seconds, *labels):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                total += count
+                le = _labels(self.labelnames, labels, [f'le="{_number(bound)}"'])
+                lines.append(f"{self.name}_bucket{le} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {total}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, *self._labels)
+
+
+class _Collected:
+    """Values read from existing stats() methods at scrape time."""
+
+    def __init__(self, name, kind, help, labelnames, func):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._func = func
+
+    def render(self):
+        values = self._func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+                  for labels, value in sorted(values.items())]
+        return lines
+
+
+class _Noop:
+    def inc(self, *labels, amount=1):
+        pass
+
+    def observe(self, seconds, *labels):
+        pass
+
+    def time(self, *labels):
+        return _NOOP_TIMER
+
+    def render(self):
+        return []
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NOOP = _Noop()
+_NOOP_TIMER = _NoopTimer()
+
+
+class Registry:
+    """Process-wide metrics, rendered in the Prometheus text format.
+
+    Every worker process keeps its own numbers; scrape each worker (or
+    aggregate on the Prometheus side) when running several.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _add(self, metric):
+        if not self.enabled:
+            return _NOOP
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def collect(self, name, kind, help, labelnames, func):
+        """Expose values computed by ``func()`` on each scrape: a number, or {label values tuple: number}."""
+        return self._add(_Collected(name, kind, help, labelnames, func))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+sqlite_seconds = registry.histogram("sqlite_statement_seconds", "Time spent executing and fetching SQLite statements",
+                                    ("statement", "phase"))
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?)\s+(\w+)", re.IGNORECASE)
+_statement_labels = {}
+
+
+def statement_label(sql):
+    """A low-cardinality name for a statement: its verb and first table, e.g. "SELECT orders"."""
+    label = _statement_labels.get(sql)
+    if label is None:
+        words = sql.split(None, 2)
+        verb = words[0].upper() if words else "?"
+        if verb == "PRAGMA" and len(words) > 1:
+            label = "PRAGMA " + re.split(r"[=(\s]", words[1], 1)[0].lower()
+        else:
+            table = _TABLE.search(sql)
+            label = f"{verb} {table.group(1)}" if table else verb
+        if len(_statement_labels) < 4096:  # statements built with varying IN (...) lists don't grow this forever
+            _statement_labels[sql] = label
+    return label
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records execute and fetch time (as separate phases) under the statement's label."""
+
+    _label = None
+
+    def _observe(self, started, phase="fetch"):
+        sqlite_seconds.observe(time.perf_counter() - started, self._label, phase)
+
+    def execute(self, sql, parameters=()):
+        self._label = statement_label(sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._observe(started, "execute")
+
+    def executemany(self, sql, seq_of_parameters):
+        self._label = statement_label(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._observe(started, "execute")
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._observe(started)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._observe(started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._observe(started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose statements and commits are timed; pass as ``factory`` to sqlite3.connect()."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            sqlite_seconds.observe(time.perf_counter() - started, "COMMIT", "execute")
@@ -0,0 +1,228 @@
+"""Cold storage for delivered orders.
+
+    python order_archive.py [--days N]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from data_storage import pool, orders, versions, on_init, init, flush_pending, order_conditions, DATE_FORMAT
+from metrics import registry
+
+# Delivered orders whose delivery_time is this many days old are moved to the archive
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+# Seconds between background archive runs in each server process; 0 (the default) turns the job off.
+# The web UI doesn't list archived orders yet, so archiving hides them from users' order history.
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "0"))
+# Orders moved per transaction
+ARCHIVE_BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", "1000"))
+
+# Primes the compressor with the JSON around every payload; most rows are only a few dozen bytes
+_ZDICT = b'{"items":{"prescription":null}'
+_COLUMNS = "order_id, username, status, delivery_time, data"
+
+_archived_count = registry.counter("orders_archived_total", "Orders moved to the archive table")
+
+
+def init_archive_table(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS orders_archive
+                    (order_id TEXT PRIMARY KEY, username TEXT, status TEXT, delivery_time TEXT,
+                     archived_at REAL, data BLOB)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_username ON orders_archive (username, order_id)")
+    conn.commit()
+
+
+def _pack(items, prescription):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=_ZDICT)
+    data = json.dumps({"items": json.loads(items), "prescription": prescription}, separators=(",", ":"))
+    return compressor.compress(data.encode("utf-8")) + compressor.flush()
+
+
+def _unpack(row):
+    decompressor = zlib.decompressobj(-15, zdict=_ZDICT)
+    data = json.loads(decompressor.decompress(row[4]) + decompressor.flush())
+    return {"username": row[1], "items": data["items"], "prescription": data["prescription"], "status": row[2],
+            "delivery_time": datetime.strptime(row[3], DATE_FORMAT)}
+
+
+class OrderArchive:
+    """Delivered orders moved out of the hot ``orders`` table.
+
+    archive_delivered() moves Delivered orders older than a cutoff in
+    batches, one BEGIN IMMEDIATE transaction each: the rows are copied here
+    with items and prescription compressed, deleted from ``orders``, and the
+    orders version is bumped so other workers drop their cached copies.
+    Orders with unsaved changes in this process are left for the next run;
+    another worker's pending edit of an archived order is dropped by its
+    flush, which only UPDATEs orders that still exist.
+    The order_items lines stay where they are, so order totals and per-medicine
+    sales still cover archived orders. Archived orders are only read on demand,
+    through get(), page() and iter_pages(), which take the same filters as
+    the order repository; restore() moves one back to ``orders``.
+    """
+
+    def __init__(self, pool, interval=ARCHIVE_INTERVAL):
+        self._pool = pool
+        self._interval = interval
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self.last_run = None
+        self.last_moved = 0
+        self.last_error = None
+
+    def archive_delivered(self, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_ROWS):
+        """Move Delivered orders with a delivery_time before now - ``older_than_days``; returns how many moved."""
+        if orders.has_changes():
+            flush_pending()
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime(DATE_FORMAT)
+        moved, after = 0, ""
+        while after is not None:
+            count, after = self._archive_batch(cutoff, after, batch_size)
+            moved += count
+        self.last_run, self.last_moved, self.last_error = time.time(), moved, None
+        return moved
+
+    def _archive_batch(self, cutoff, after, batch_size):
+        with self._pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                selected = conn.execute("SELECT order_id, username, items, prescription, status, delivery_time "
+                                        "FROM orders WHERE status = 'Delivered' AND delivery_time < ? "
+                                        "AND order_id > ? ORDER BY order_id LIMIT ?",
+                                        (cutoff, after, batch_size)).fetchall()
+                pending = orders.pending_ids()
+                rows = [row for row in selected if row[0] not in pending]
+                bumped = set()
+                if rows:
+                    now = time.time()
+                    conn.executemany(f"INSERT OR REPLACE INTO orders_archive ({_COLUMNS}, archived_at) "
+                                     "VALUES (?, ?, ?, ?, ?, ?)",
+                                     [(oid, username, status, delivery_time, _pack(items, prescription), now)
+                                      for oid, username, items, prescription, status, delivery_time in rows])
+                    conn.executemany("DELETE FROM orders WHERE order_id = ?", [(row[0],) for row in rows])
+                    bumped = versions.bump_keys(conn, "orders", [row[0] for row in rows])
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        if rows:
+            orders.forget([row[0] for row in rows])
+            versions.written(bumped)
+            _archived_count.inc(amount=len(rows))
+        # Continue after the last row looked at, skipped or not; a short page is the end
+        return len(rows), selected[-1][0] if len(selected) == batch_size else None
+
+    def get(self, order_id):
+        with self._pool.connection() as conn:
+            row = conn.execute(f"SELECT {_COLUMNS} FROM orders_archive WHERE order_id = ?", (order_id,)).fetchone()
+        return None if row is None else _unpack(row)
+
+    def restore(self, order_id):
+        """Move an archived order back to ``orders`` (e.g. to change its status); returns it, or None if not archived."""
+        with self._pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(f"SELECT {_COLUMNS} FROM orders_archive WHERE order_id = ?", (order_id,)).fetchone()
+                if row is None:
+                    conn.rollback()
+                    return None
+                order = _unpack(row)
+                # Its order_items lines never left, so only the orders row is written back
+                conn.execute("INSERT OR REPLACE INTO orders (order_id, username, items, prescription, status, "
+                             "delivery_time) VALUES (?, ?, ?, ?, ?, ?)",
+                             (order_id, order["username"], json.dumps(order["items"], separators=(",", ":")),
+                              order["prescription"], order["status"], row[3]))
+                conn.execute("DELETE FROM orders_archive WHERE order_id = ?", (order_id,))
+                bumped = versions.bump_keys(conn, "orders", [order_id])
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        versions.written(bumped)
+        return orders.remember(order_id, order)
+
+    def query(self, where="", params=(), limit=None):
+        """Return [(order_id, order)] for archived orders matching an SQL condition, oldest id first."""
+        sql = f"SELECT {_COLUMNS} FROM orders_archive"
+        if where:
+            sql += f" WHERE {where}"
+        sql += " ORDER BY order_id"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self._pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [(row[0], _unpack(row)) for row in rows]
+
+    def page(self, username=None, status=None, since=None, until=None, after=None, limit=None,
+             created_since=None, created_until=None):
+        """Keyset-paginated listing with the same filters as OrderRepository.page()."""
+        where, params = order_conditions(username, status, since, until, after, created_since, created_until)
+        return self.query(where, params, limit=limit)
+
+    def iter_pages(self, username=None, status=None, since=None, until=None, batch_size=500,
+                   created_since=None, created_until=None):
+        after = None
+        while True:
+            batch = self.page(username, status, since, until, after, batch_size, created_since, created_until)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = batch[-1][0]
+
+    def start(self):
+        """Run archive_delivered() every ``interval`` seconds on a daemon thread in this process."""
+        if self._interval <= 0 or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            # Threads don't survive a fork; a forked child starts its own
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="order-archiver", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+        self._stopping.clear()
+
+    def _run(self):
+        while not self._stopping.wait(self._interval):
+            try:
+                self.archive_delivered()
+            except Exception as e:
+                self.last_error = str(e)
+
+    def stats(self):
+        with self._pool.connection() as conn:
+            archived = conn.execute("SELECT COUNT(*), COALESCE(SUM(length(data)), 0) FROM orders_archive").fetchone()
+        return {"archived": archived[0], "archived_bytes": archived[1], "running": self._thread is not None,
+                "interval": self._interval, "last_run": self.last_run, "last_moved": self.last_moved,
+                "last_error": self.last_error}
+
+
+on_init(init_archive_table)
+order_archive = OrderArchive(pool)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=float, default=ARCHIVE_AFTER_DAYS,
+                        help=f"archive Delivered orders older than this (default {ARCHIVE_AFTER_DAYS:g})")
+    parser.add_argument("--batch", type=int, default=ARCHIVE_BATCH_ROWS, help="orders moved per transaction")
+    args = parser.parse_args()
+    init()
+    moved = order_archive.archive_delivered(args.days, args.batch)
+    print(f"{moved} order(s) archived; {order_archive.stats()['archived']} in the archive")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from functools import wraps
+
+# Admin profiling endpoints are off unless this is set to 1
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# Upper bound on the number of requests one profiling session may capture
+PROFILE_MAX_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "1000"))
+# tracemalloc snapshots kept for diffing
+MEMORY_SNAPSHOTS = int(os.getenv("MEMORY_SNAPSHOTS", "5"))
+MODES = ("cprofile", "sample")
+
+
+class _Session:
+    def __init__(self, endpoint, original, requests, mode, interval):
+        self.endpoint = endpoint
+        self.original = original
+        self.requested = requests
+        self.remaining = requests
+        self.mode = mode
+        self.interval = interval
+        self.state = "running"
+        self.in_flight = 0
+        self.done = 0
+        self.wall_times = []
+        self.stats = None          # merged pstats.Stats (cprofile mode)
+        self.samples = Counter()   # collapsed stack -> sample count (sample mode)
+        self.active = set()        # thread idents currently inside the profiled view
+        self.wrapper_code = None
+        self.started_at = time.time()
+
+
+class RouteProfiler:
+    """Profiles the next N requests to one Flask view, then puts the view back.
+
+    Arming swaps the view in ``app.view_functions`` for a wrapper; nothing is
+    wrapped while idle, so requests that aren't being profiled run exactly as
+    before. In ``cprofile`` mode each request gets its own profiler and the
+    results are merged into pstats output. In ``sample`` mode a background
+    thread records the stacks of the threads serving the view every
+    ``interval`` seconds and the result is collapsed stacks (one
+    ``frame;frame;frame count`` line per stack, the flame graph input format).
+    Only the view itself is profiled, not the before/after request hooks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._app = None
+        self._session = None
+
+    def start(self, app, endpoint, requests, mode="cprofile", interval=0.005):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if endpoint not in app.view_functions:
+            raise ValueError(f"unknown endpoint {endpoint}")
+        requests = max(1, min(int(requests), PROFILE_MAX_REQUESTS))
+        with self._lock:
+            if self._session is not None and self._session.state == "running":
+                raise ValueError(f"already profiling {self._session.endpoint}")
+            session = _Session(endpoint, app.view_functions[endpoint], requests, mode, max(0.001, float(interval)))
+            self._app, self._session = app, session
+            app.view_functions[endpoint] = self._wrap(session)
+        if mode == "sample":
+            threading.Thread(target=self._sample, args=(session,), name="profile-sampler", daemon=True).start()
+        return self.status()
+
+    def stop(self):
+        """Put the view back now; requests already captured are kept."""
+        with self._lock:
+            if self._session is not None and self._session.state == "running":
+                self._finish(self._session, "stopped")
+        return self.status()
+
+    def _finish(self, session, state):
+        # Called with the lock held
+        if self._app.view_functions.get(session.endpoint) is not session.original:
+            self._app.view_functions[session.endpoint] = session.original
+        session.state = state
+
+    def _wrap(self, session):
+        original = session.original
+
+        @wraps(original)
+        def profiled(*args, **kwargs):
+            with self._lock:
+                claimed = session.state == "running" and session.remaining > 0
+                if claimed:
+                    session.remaining -= 1
+                    session.in_flight += 1
+            if not claimed:
+                return original(*args, **kwargs)
+            profile = cProfile.Profile() if session.mode == "cprofile" else None
+            ident = threading.get_ident()
+            started = time.perf_counter()
+            try:
+                if profile is not None:
+                    return profile.runcall(original, *args, **kwargs)
+                with self._lock:
+                    session.active.add(ident)
+                return original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    session.active.discard(ident)
+                    if profile is not None:
+                        if session.stats is None:
+                            session.stats = pstats.Stats(profile)
+                        else:
+                            session.stats.add(profile)
+                    session.wall_times.append(elapsed)
+                    session.in_flight -= 1
+                    session.done += 1
+                    if session.state == "running" and session.remaining == 0 and session.in_flight == 0:
+                        self._finish(session, "done")
+
+        session.wrapper_code = profiled.__code__
+        return profiled
+
+    def _sample(self, session):
+        while session.state == "running":
+            time.sleep(session.interval)
+            with self._lock:
+                active = list(session.active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident in active:
+                frame = frames.get(ident)
+                stack = []
+                # Stop at the wrapper so server and Flask frames below the view are left out
+                while frame is not None and frame.f_code is not session.wrapper_code:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    with self._lock:
+                        session.samples[";".join(reversed(stack))] += 1
+
+    def status(self):
+        with self._lock:
+            session = self._session
+            if session is None:
+                return {"state": "idle"}
+            times = sorted(session.wall_times)
+            return {"state": session.state, "endpoint": session.endpoint, "mode": session.mode,
+                    "requested": session.requested, "profiled": session.done, "in_flight": session.in_flight,
+                    "started_at": session.started_at,
+                    "mean_ms": round(sum(times) / len(times) * 1000, 3) if times else None,
+                    "max_ms": round(times[-1] * 1000, 3) if times else None}
+
+    def report(self, sort="cumulative", limit=40):
+        """Status plus the output so far: pstats text (cprofile) or collapsed stacks (sample)."""
+        result = self.status()
+        session = self._session
+        if session is None:
+            return result
+        with self._lock:
+            if session.mode == "cprofile":
+                out = io.StringIO()
+                if session.stats is not None:
+                    session.stats.stream = out
+                    session.stats.sort_stats(sort).print_stats(limit)
+                result["pstats"] = out.getvalue()
+            else:
+                result["samples"] = sum(session.samples.values())
+                result["collapsed"] = "\n".join(f"{stack} {count}" for stack, count in session.samples.most_common())
+        return result
+
+
+class MemoryTracker:
+    """tracemalloc snapshots and the difference between them.
+
+    Tracing only runs between start() and stop(); allocations made before
+    start() are invisible, so start it, let traffic run, and take snapshots
+    some time apart to see what grows.
+    """
+
+    def __init__(self, keep=MEMORY_SNAPSHOTS):
+        self._lock = threading.Lock()
+        self._keep = keep
+        self._snapshots = []  # (id, taken_at, snapshot)
+        self._next_id = 1
+
+    def start(self, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, int(frames)))
+        return self.status()
+
+    def stop(self):
+        with self._lock:
+            self._snapshots = []
+        tracemalloc.stop()
+        return self.status()
+
+    def status(self):
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            ids = [sid for sid, _, _ in self._snapshots]
+        return {"tracing": tracemalloc.is_tracing(), "frames": tracemalloc.get_traceback_limit(),
+                "traced_bytes": current, "peak_bytes": peak, "snapshots": ids}
+
+    def snapshot(self, key="lineno", limit=20):
+        """Take a snapshot; return its largest allocation sites and the change since the previous one."""
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc is not running")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        with self._lock:
+            sid = self._next_id
+            self._next_id += 1
+            previous = self._snapshots[-1] if self._snapshots else None
+            self._snapshots.append((sid, time.time(), snapshot))
+            del self._snapshots[:-self._keep]
+        result = dict(self.status(), id=sid, top=[_stat(stat) for stat in snapshot.statistics(key)[:limit]])
+        if previous is not None:
+            result["diff_from"] = previous[0]
+            result["diff"] = [_stat(stat) for stat in snapshot.compare_to(previous[2], key)[:limit]]
+        return result
+
+    def diff(self, from_id, to_id=None, key="lineno", limit=20):
+        with self._lock:
+            snapshots = {sid: snapshot for sid, _, snapshot in self._snapshots}
+            to_id = to_id or (self._snapshots[-1][0] if self._snapshots else None)
+        if from_id not in snapshots or to_id not in snapshots:
+            raise ValueError(f"snapshots kept: {sorted(snapshots)}")
+        stats = snapshots[to_id].compare_to(snapshots[from_id], key)
+        return {"from": from_id, "to": to_id, "diff": [_stat(stat) for stat in stats[:limit]]}
+
+
+def _stat(stat):
+    frame = stat.traceback[0]
+    entry = {"where": f"{frame.filename}:{frame.lineno}", "size_bytes": stat.size, "count": stat.count}
+    if hasattr(stat, "size_diff"):
+        entry["size_diff"] = stat.size_diff
+        entry["count_diff"] = stat.count_diff
+    if len(stat.traceback) > 1:
+        entry["traceback"] = [f"{f.filename}:{f.lineno}" for f in stat.traceback]
+    return entry
+
+
+route_profiler = RouteProfiler()
+memory_tracker = MemoryTracker()
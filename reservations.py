@@ -0,0 +1,242 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from data_storage import pool, medicines, orders, cart, flush_pending, versions, on_init, write_order, place_with_fresh_id
+
+# How long stock stays held for an item sitting in a cart
+STOCK_HOLD_SECONDS = float(os.getenv("STOCK_HOLD_SECONDS", "900"))
+
+
+class InsufficientStock(Exception):
+    def __init__(self, medicine, *more, available=None):
+        names = (medicine,) + more
+        super().__init__(f"Insufficient stock for {', '.join(names)}")
+        self.medicine = medicine
+        self.medicines = list(names)
+        # Units each short line could have had (free stock plus the user's own hold), when known
+        self.available = available or {}
+
+
+def init_holds_table(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS stock_holds
+                    (username TEXT, medicine TEXT, quantity INTEGER, expires_at REAL,
+                     PRIMARY KEY (username, medicine))''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_holds_expires ON stock_holds (expires_at)")
+    conn.commit()
+
+
+class StockReservations:
+    """Oversell-free stock changes done in SQLite rather than in memory.
+
+    Every decrement is ``UPDATE ... SET stock = stock - ? WHERE stock >= ?``
+    inside a write transaction, so concurrent threads and processes can
+    never take more than is on the shelf, and an order either gets every
+    line or nothing. Items put in a cart are held (taken from stock) for
+    STOCK_HOLD_SECONDS; holds are released on removal and swept back into
+    stock lazily by the next transaction after they expire. The in-memory
+    catalog is refreshed with the committed stock values.
+    """
+
+    def __init__(self, pool, catalog, hold_seconds=STOCK_HOLD_SECONDS, versions=None, orders=None):
+        self._pool = pool
+        self._versions = versions
+        self._catalog = catalog
+        self._orders = orders
+        self._hold_seconds = hold_seconds
+        self._commit_lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self):
+        # New catalog rows may still be waiting in a write-behind batch
+        if self._catalog.has_changes():
+            flush_pending()
+        stock = {}
+        bumped = None
+        with self._pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire(conn, stock)
+                yield conn, stock
+                if stock and self._versions is not None:
+                    # Other workers re-read only these rows
+                    bumped = self._versions.bump_keys(conn, "medicines", stock)
+                # Two threads' refreshes could otherwise land out of commit order and leave stale stock
+                with self._commit_lock:
+                    conn.commit()
+                    for name, value in stock.items():
+                        self._catalog.refresh(name, stock=value)
+            except BaseException:
+                conn.rollback()
+                raise
+        if bumped:
+            self._versions.written(bumped)
+
+    def _take(self, conn, stock, medicine, quantity):
+        row = conn.execute("UPDATE medicines SET stock = stock - ? WHERE name = ? AND stock >= ? RETURNING stock",
+                           (quantity, medicine, quantity)).fetchone()
+        if row is None:
+            raise InsufficientStock(medicine)
+        stock[medicine] = row[0]
+
+    def _give(self, conn, stock, medicine, quantity):
+        row = conn.execute("UPDATE medicines SET stock = stock + ? WHERE name = ? RETURNING stock",
+                           (quantity, medicine)).fetchone()
+        if row is not None:
+            stock[medicine] = row[0]
+
+    def _adjust(self, conn, stock, medicine, delta):
+        if delta > 0:
+            self._take(conn, stock, medicine, delta)
+        elif delta < 0:
+            self._give(conn, stock, medicine, -delta)
+
+    def _expire(self, conn, stock):
+        expired = conn.execute("DELETE FROM stock_holds WHERE expires_at <= ? RETURNING medicine, quantity",
+                               (time.time(),)).fetchall()
+        for medicine, quantity in expired:
+            self._give(conn, stock, medicine, quantity)
+        return len(expired)
+
+    def _held(self, conn, username):
+        return dict(conn.execute("SELECT medicine, quantity FROM stock_holds WHERE username = ?",
+                                 (username,)).fetchall())
+
+    def hold(self, username, medicine, quantity):
+        """Hold ``quantity`` units for the user's cart line, replacing any earlier hold.
+
+        Raises InsufficientStock if the extra units are not available.
+        """
+        if quantity <= 0:
+            self.release(username, medicine)
+            return
+        with self._transaction() as (conn, stock):
+            held = self._held(conn, username).get(medicine, 0)
+            self._adjust(conn, stock, medicine, quantity - held)
+            conn.execute("INSERT OR REPLACE INTO stock_holds (username, medicine, quantity, expires_at) "
+                         "VALUES (?, ?, ?, ?)", (username, medicine, quantity, time.time() + self._hold_seconds))
+
+    def set_holds(self, username, quantities, write=None):
+        """Hold exactly ``quantities[medicine]`` units per cart line (0 releases it), all lines or none.
+
+        ``write(conn)`` runs inside the same transaction (e.g. to write the
+        cart rows) and its result is returned. Raises InsufficientStock
+        naming every line that can't be held, with what is available for each.
+        """
+        with self._transaction() as (conn, stock):
+            held = self._held(conn, username)
+            expires_at = time.time() + self._hold_seconds
+            short = []
+            for medicine in sorted(quantities):
+                quantity = max(0, quantities[medicine])
+                try:
+                    self._adjust(conn, stock, medicine, quantity - held.get(medicine, 0))
+                except InsufficientStock:
+                    short.append(medicine)
+                    continue
+                if quantity:
+                    conn.execute("INSERT OR REPLACE INTO stock_holds (username, medicine, quantity, expires_at) "
+                                 "VALUES (?, ?, ?, ?)", (username, medicine, quantity, expires_at))
+                else:
+                    conn.execute("DELETE FROM stock_holds WHERE username = ? AND medicine = ?", (username, medicine))
+            if short:
+                available = {}
+                for medicine in short:
+                    row = conn.execute("SELECT stock FROM medicines WHERE name = ?", (medicine,)).fetchone()
+                    available[medicine] = (row[0] if row else 0) + held.get(medicine, 0)
+                raise InsufficientStock(*short, available=available)
+            return write(conn) if write is not None else None
+
+    def release(self, username, medicine):
+        """Return held stock for one cart line."""
+        if not isinstance(medicine, str):
+            raise ValueError(f"invalid medicine {medicine!r}")
+        with self._transaction() as (conn, stock):
+            released = conn.execute("DELETE FROM stock_holds WHERE username = ? AND medicine = ? "
+                                    "RETURNING medicine, quantity", (username, medicine)).fetchall()
+            for med, quantity in released:
+                self._give(conn, stock, med, quantity)
+
+    def reserve(self, username, items, write=None):
+        """Take stock for an order, all lines or none.
+
+        The user's holds count towards their lines; anything held beyond
+        the order goes back to stock and the holds are dropped. ``write(conn)``
+        runs inside the same transaction (e.g. to insert the order row) and
+        its result is returned. Raises InsufficientStock naming the first
+        line that cannot be filled, and ValueError for a line below 1.
+        """
+        for medicine, quantity in items.items():
+            if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+                raise ValueError(f"invalid quantity {quantity!r} for {medicine}")
+        with self._transaction() as (conn, stock):
+            held = self._held(conn, username)
+            conn.execute("DELETE FROM stock_holds WHERE username = ?", (username,))
+            for medicine in sorted(set(items) | set(held)):
+                self._adjust(conn, stock, medicine, items.get(medicine, 0) - held.get(medicine, 0))
+            return write(conn) if write is not None else None
+
+    def cancel(self, order_id, username=None):
+        """Delete a Processing order and put its stock back in one transaction.
+
+        Only the call that actually deletes the row returns stock, so
+        concurrent cancels of one order (from any process) restore it once.
+        With ``username`` only that user's order qualifies. Returns the
+        cancelled order's items, or None if no such order was still open.
+        """
+        if self._orders is not None and self._orders.has_changes():
+            flush_pending()
+        bumped = None
+        with self._transaction() as (conn, stock):
+            row = conn.execute("DELETE FROM orders WHERE order_id = ? AND status = 'Processing' "
+                               "AND (? IS NULL OR username = ?) RETURNING items",
+                               (order_id, username, username)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM order_items WHERE order_id = ?", (order_id,))
+            items = json.loads(row[0])
+            for medicine, quantity in items.items():
+                self._give(conn, stock, medicine, quantity)
+            if self._versions is not None:
+                bumped = self._versions.bump_keys(conn, "orders", [order_id])
+        if self._orders is not None:
+            self._orders.forget([order_id])
+        if bumped:
+            self._versions.written(bumped)
+        return items
+
+    def expire_holds(self):
+        """Return expired holds to stock now; returns how many were released."""
+        with self._transaction() as (conn, stock):
+            return self._expire(conn, stock)
+
+    def stats(self):
+        with self._pool.connection() as conn:
+            count, units = conn.execute("SELECT COUNT(*), COALESCE(SUM(quantity), 0) FROM stock_holds "
+                                        "WHERE expires_at > ?", (time.time(),)).fetchone()
+        return {"holds": count, "held_units": units}
+
+
+on_init(init_holds_table)
+reservations = StockReservations(pool, medicines, versions=versions, orders=orders)
+
+
+def place_cart_order(username, order):
+    """Turn the user's cart into ``order`` (whose items are the cart lines); returns the new order id.
+
+    Stock, the order row and the emptied cart are committed in one
+    transaction under a fresh order id, so nothing changes if a line is
+    short. Raises InsufficientStock, ValueError for a bad quantity, and
+    sqlite3.IntegrityError if no free order id was found. Callers hold
+    ``cart.lock(username)`` while they read the cart and call this.
+    """
+    items = order["items"]
+    cleared = {medicine: 0 for medicine in items}
+    order_id, bumped = place_with_fresh_id(lambda order_id: reservations.reserve(
+        username, items, write=lambda conn: {
+            **write_order(conn, order_id, order), **cart.write_lines(conn, username, cleared)}))
+    orders.remember(order_id, order)
+    cart.lines_written(username, cleared, bumped)
+    return order_id
@@ -1,28 +1,77 @@
-from flask import Flask, request, jsonify, render_template, session
-from data_storage import medicines, cart, save_data, users, orders, generate_order_id, calculate_delivery_time, calculate_total_cost
+from dotenv import load_dotenv
+
+# Load environment variables from .env file (before the modules below read their settings)
+load_dotenv()
+
+from flask import Flask, request, jsonify, render_template, session, Response, g
+from data_storage import medicines, cart, save_data, users, orders, calculate_delivery_time, calculate_total_cost, order_totals, sync, init, pool_stats
+from catalog_search import catalog_index
+from catalog_cache import catalog_cache, index_cache, etag_matches
+from extraction import extract, extract_batch, extraction_stats, EXTRACT_BATCH_MAX
+from jobs import job_queue, decode_image, FINAL_STATES
+from reservations import reservations, place_cart_order, InsufficientStock
+from metrics import registry
+from profiling import route_profiler, memory_tracker, PROFILING_ENABLED
+from cart_batch import apply_cart_batch, validate_quantity, CartBatchError
+from catalog_io import import_catalog, export_catalog, guess_format, FORMATS as CATALOG_FORMATS
+from order_ids import id_time
+from order_archive import order_archive, ARCHIVE_AFTER_DAYS
+import io
+import sqlite3
 import os
 import json
-import difflib
-from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import uuid
+import time
 
-# Load environment variables from .env file
-load_dotenv()
-
-try:
-    import google.generativeai as genai
-except Exception:  # library may not be installed yet during initial run
-    genai = None
+# Start background job workers with the first request in each process
+JOB_AUTOSTART = os.getenv("JOB_AUTOSTART", "1") == "1"
 
 app = Flask(__name__, template_folder=".")
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-this-in-production')
+# Files under static/ are served with long-lived cache headers; give them versioned names
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = int(os.getenv('STATIC_MAX_AGE', '31536000'))
+# Largest request body accepted (uploads to /jobs, catalog imports, ...); larger ones get a 413
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', str(16 * 1024 * 1024)))
+# Point this at a copy under /static/ to self-host OCR; the CDN URL is pinned to a version
+TESSERACT_JS_URL = os.getenv('TESSERACT_JS_URL', 'https://cdn.jsdelivr.net/npm/tesseract.js@2.1.0/dist/tesseract.min.js')
+
+request_seconds = registry.histogram("http_request_seconds", "Request latency by route", ("route", "method"))
+request_count = registry.counter("http_requests_total", "Requests by route, method and status",
+                                 ("route", "method", "status"))
+request_errors = registry.counter("http_request_errors_total", "Requests answered with a 5xx status",
+                                  ("route", "method"))
+
+if registry.enabled:
+    # Registered first so the timing covers the other hooks; skipped entirely with METRICS_ENABLED=0
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('request_started')
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            request_seconds.observe(time.perf_counter() - started, route, request.method)
+            request_count.inc(route, request.method, str(response.status_code))
+            if response.status_code >= 500:
+                request_errors.inc(route, request.method)
+        return response
+
+@app.before_request
+def sync_shared_state():
+    # Loads the data on the first request; afterwards picks up writes from other worker processes
+    sync()
+    if JOB_AUTOSTART:
+        job_queue.start()
+    order_archive.start()
 
 @app.after_request
 def add_cors_headers(response):
     # Allow CORS for local development and file:// origin use-cases
     response.headers['Access-Control-Allow-Origin'] = request.headers.get('Origin', '*') or '*'
-    response.headers['Vary'] = 'Origin'
+    response.vary.add('Origin')
     response.headers['Access-Control-Allow-Credentials'] = 'true'
     response.headers['Access-Control-Allow-Methods'] = 'GET,POST,OPTIONS'
     response.headers['Access-Control-Allow-Headers'] = request.headers.get('Access-Control-Request-Headers', 'Content-Type')
@@ -31,7 +80,10 @@ def add_cors_headers(response):
 # CORS preflight for all endpoints
 @app.route('/add_to_cart', methods=['OPTIONS'])
 @app.route('/extract_medicines', methods=['OPTIONS'])
+@app.route('/extract_medicines_batch', methods=['OPTIONS'])
+@app.route('/jobs', methods=['OPTIONS'])
 @app.route('/medicines', methods=['OPTIONS'])
+@app.route('/search', methods=['OPTIONS'])
 @app.route('/login', methods=['OPTIONS'])
 @app.route('/register', methods=['OPTIONS'])
 @app.route('/logout', methods=['OPTIONS'])
@@ -41,98 +93,178 @@ def add_cors_headers(response):
 @app.route('/place_order', methods=['OPTIONS'])
 @app.route('/get_orders', methods=['OPTIONS'])
 @app.route('/cancel_order', methods=['OPTIONS'])
+@app.route('/cart/batch', methods=['OPTIONS'])
 def cors_preflight():
     # Respond to preflight requests for specific endpoints
     return ('', 204)
 
 @app.route("/")
 def index():
-    # Render index.html and pass medicines and current user to it
+    # Render index.html and pass medicines and current user to it. The page only
+    # depends on the catalog and the user, so it's rendered once per catalog version and user.
     current_user = session.get('username')
-    return render_template("index.html", medicines=medicines, current_user=current_user)
+    page, etag = index_cache.get(catalog_cache.version, current_user, lambda: render_template(
+        "index.html", medicines_json=catalog_cache.html_json(), current_user=current_user,
+        tesseract_url=TESSERACT_JS_URL))
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response = Response(status=304)
+    else:
+        response = Response(page, mimetype='text/html')
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
 
 @app.route("/medicines", methods=["GET"])
 def get_medicines():
-    # Provide a JSON endpoint for clients that open the HTML without templating
-    return jsonify(medicines)
-
-def _server_side_fuzzy_detect(text: str, med_keys):
-    """Fallback detection using difflib if Gemini is unavailable."""
-    text_l = text.lower()
-    found = set()
-    # quick contains
-    for k in med_keys:
-        if k.lower() in text_l:
-            found.add(k)
-    # token-based close matches
-    tokens = [t for t in ''.join([c if c.isalpha() or c.isspace() else ' ' for c in text_l]).split() if len(t) >= 4]
-    for t in set(tokens):
-        close = difflib.get_close_matches(t, [mk.lower() for mk in med_keys], n=1, cutoff=0.82)
-        if close:
-            idx = [mk.lower() for mk in med_keys].index(close[0])
-            found.add(med_keys[idx])
-    return sorted(found)
+    # Provide a JSON endpoint for clients that open the HTML without templating.
+    # The body is serialized (and compressed) once per catalog version; clients
+    # revalidate with the ETag and get a 304 while nothing has changed.
+    body, encoding, etag = catalog_cache.payload(request.headers.get('Accept-Encoding', ''))
+    if catalog_cache.matches(request.headers.get('If-None-Match')):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route("/search", methods=["GET"])
+def search():
+    # Ranked catalog search so clients don't need the full /medicines payload
+    query = request.args.get('q', '')
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 100))
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid limit"}), 400
+    results = []
+    for name, score in catalog_index.search(query, limit):
+        details = medicines.get(name)
+        if details is not None:
+            results.append({"name": name, "price": details['price'], "stock": details['stock'], "score": score})
+    return jsonify({"success": True, "query": query, "results": results})
 
 @app.route("/extract_medicines", methods=["POST"])
 def extract_medicines():
     data = request.get_json(silent=True) or {}
     text = data.get("text", "")
-    med_keys = list(medicines.keys())
     if not text.strip():
         return jsonify({"detected": [], "error": "empty_text"}), 400
+    return jsonify(extract(text))
 
-    api_key = os.getenv("api_key")
-    if genai is None or not api_key:
-        detected = _server_side_fuzzy_detect(text, med_keys)
-        return jsonify({
-            "detected": detected,
-            "source": "fallback",
-            "model": None
-        })
+@app.route("/extract_medicines_batch", methods=["POST"])
+def extract_medicines_batch():
+    # Many OCR texts in one round trip, e.g. a scanned stack of prescriptions
+    data = request.get_json(silent=True) or {}
+    texts = data.get("texts")
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return jsonify({"success": False, "message": "texts must be a list of strings"}), 400
+    if len(texts) > EXTRACT_BATCH_MAX:
+        return jsonify({"success": False, "message": f"At most {EXTRACT_BATCH_MAX} texts per batch"}), 400
+    started = time.perf_counter()
+    results = extract_batch(texts)
+    return jsonify({
+        "success": True,
+        "results": results,
+        "count": len(results),
+        "unique": sum(1 for r in results if "source" in r and not r.get("duplicate")),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+
+@app.route("/extract_medicines/stats", methods=["GET"])
+def extract_medicines_stats():
+    # Cache hit/miss and request coalescing counters for the extraction pipeline
+    return jsonify(dict(extraction_stats(), jobs=job_queue.stats()))
+
+def _cache_counts(field):
+    extraction_cache = extraction_stats()["cache"]
+    return {("orders",): orders.cache_stats()[field], ("extraction",): extraction_cache[field],
+            ("index_page",): index_cache.stats()[field]}
+
+registry.collect("cache_hits_total", "counter", "Cache hits", ("cache",), lambda: _cache_counts("hits"))
+registry.collect("cache_misses_total", "counter", "Cache misses", ("cache",), lambda: _cache_counts("misses"))
+registry.collect("catalog_cache_builds_total", "counter", "Times the /medicines body was rebuilt", (),
+                 lambda: catalog_cache.builds)
+registry.collect("extraction_upstream_calls_total", "counter", "Model calls started", (),
+                 lambda: extraction_stats()["upstream_calls"])
+registry.collect("extraction_coalesced_total", "counter", "Extractions that joined an identical in-flight one", (),
+                 lambda: extraction_stats()["coalesced"])
+registry.collect("extraction_circuit_open", "gauge", "1 while the model circuit breaker is open", (),
+                 lambda: int(extraction_stats()["circuit"]["state"] == "open"))
+registry.collect("sqlite_pool_connections", "gauge", "Pooled SQLite connections by state", ("state",),
+                 lambda: {("in_use",): pool_stats()["in_use"], ("idle",): pool_stats()["idle"]})
+registry.collect("sqlite_pool_waits_total", "counter", "Connection requests that had to wait", (),
+                 lambda: pool_stats()["waits"])
+registry.collect("sqlite_pool_wait_seconds_total", "counter", "Time spent waiting for a pooled connection", (),
+                 lambda: pool_stats()["wait_time_s"])
 
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    # Prometheus text format; numbers are per worker process
+    if not registry.enabled:
+        return jsonify({"success": False, "message": "Metrics are disabled"}), 404
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Asynchronous prescription processing: submit, then poll or subscribe for the result
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    upload = request.files.get('image')
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    image, text = data.get('image'), data.get('text', '')
+    if not isinstance(image, (str, type(None))) or not isinstance(text, str):
+        return jsonify({"success": False, "message": "text and image must be strings"}), 400
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("models/gemini-2.0-flash-exp")
-        sys_prompt = (
-            "You extract medicine names from the provided OCR text. "
-            "Only return medicines that exist in the provided 'allowed_medicines' list. "
-            "Ignore non-medicine words, numbers, headers (like Medicines:, Name:, Age:). "
-            "Return a compact JSON array of strings with exact values from allowed_medicines. No extra text."
-        )
-        prompt = (
-            f"allowed_medicines = {json.dumps(med_keys)}\n\n"
-            f"ocr_text = '''\n{text}\n'''\n\n"
-            "Respond with JSON array only, e.g., [\"Paracetamol\", \"Ibuprofen\"]."
-        )
-        resp = model.generate_content([sys_prompt, prompt])
-        raw = resp.text.strip() if hasattr(resp, 'text') else ''
-        # try to extract JSON array
-        start = raw.find('[')
-        end = raw.rfind(']')
-        detected = []
-        if start != -1 and end != -1 and end > start:
-            json_str = raw[start:end+1]
-            detected = json.loads(json_str)
-        if not isinstance(detected, list):
-            detected = []
-        # Filter to med_keys to be safe
-        detected = [d for d in detected if d in medicines]
-        # If empty, try fallback to difflib as a safety net
-        if not detected:
-            detected = _server_side_fuzzy_detect(text, med_keys)
-        return jsonify({
-            "detected": detected,
-            "source": "gemini",
-            "model": "gemini-2.0-flash-exp"
-        })
-    except Exception as e:
-        detected = _server_side_fuzzy_detect(text, med_keys)
-        return jsonify({
-            "detected": detected,
-            "source": "error_fallback",
-            "model": None,
-            "error": str(e)
-        })
+        if upload is not None:
+            job_id = job_queue.submit("image", upload.read())
+        elif image:
+            job_id = job_queue.submit("image", decode_image(image))
+        elif text.strip():
+            job_id = job_queue.submit("text", text)
+        else:
+            return jsonify({"success": False, "message": "Provide text or an image"}), 400
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid image encoding"}), 400
+    return jsonify({"success": True, "job_id": job_id, "status": "queued"}), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify(dict(job, success=True))
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    # Server-Sent Events: one event per status/stage change until the job finishes
+    if job_queue.get(job_id) is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    try:
+        timeout = float(request.args.get('timeout', 60))
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid timeout"}), 400
+    if not timeout >= 0:  # also rejects nan
+        return jsonify({"success": False, "message": "Invalid timeout"}), 400
+    timeout = min(timeout, 300)
+
+    def generate():
+        last = None
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = job_queue.get(job_id)
+            state = (job['status'], job['stage'])
+            if state != last:
+                yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+                last = state
+            if job['status'] in FINAL_STATES:
+                return
+            time.sleep(0.25)
+        yield "event: timeout\ndata: {}\n\n"
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 # Authentication endpoints
 @app.route("/login", methods=["POST"])
@@ -214,57 +346,85 @@ def add_to_cart():
         added = []
         for med in data.get("medicines", []):
             if med in medicines:
-                cart[med] = cart.get(med, 0) + 1
+                with cart.lock(username):
+                    try:
+                        reservations.hold(username, med, cart.quantity(username, med) + 1)
+                    except InsufficientStock:
+                        continue
+                    cart.add(username, med, 1)
                 added.append(med)
-        save_data(medicines, users, orders, cart)
         return jsonify({
             "success": True,
             "message": f"Added {', '.join(added)} to cart!" if added else "No valid medicines found"
         })
     else:  # Single medicine add
         medicine = data.get('medicine')
-        quantity = data.get('quantity', 1)
+        try:
+            quantity = validate_quantity(data.get('quantity', 1), 1)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
         
         if not medicine or medicine not in medicines:
             return jsonify({"success": False, "message": "Medicine not found"})
         
-        if medicines[medicine]['stock'] < quantity:
-            return jsonify({"success": False, "message": "Insufficient stock"})
-        
-        cart[medicine] = cart.get(medicine, 0) + quantity
-        save_data(medicines, users, orders, cart)
+        # Stock is held for the cart line until the order is placed or the hold expires
+        with cart.lock(username):
+            try:
+                reservations.hold(username, medicine, cart.quantity(username, medicine) + quantity)
+            except InsufficientStock:
+                return jsonify({"success": False, "message": "Insufficient stock"})
+            cart.add(username, medicine, quantity)
         return jsonify({"success": True, "message": f"Added {quantity} {medicine} to cart"})
 
+@app.route("/cart/batch", methods=["POST"])
+def cart_batch():
+    # Several add/set/remove operations applied together: all of them or none
+    data = request.get_json(silent=True) or {}
+    username = data.get('username')
+    if not username:
+        return jsonify({"success": False, "message": "User not authenticated"})
+    try:
+        result = apply_cart_batch(username, data.get('operations'))
+    except CartBatchError as e:
+        return jsonify({"success": False, "message": "Invalid operations", "errors": e.errors}), 400
+    except InsufficientStock as e:
+        return jsonify({"success": False, "message": str(e), "cart": cart.get(username),
+                        "shortages": [{"medicine": m, "available": e.available.get(m)} for m in e.medicines]}), 409
+    return jsonify(dict(result, success=True))
+
 @app.route("/get_cart", methods=["GET"])
 def get_cart():
     username = request.args.get('username')
     if not username:
         return jsonify({"success": False, "message": "User not authenticated"})
     
-    return jsonify({"success": True, "cart": cart})
+    return jsonify({"success": True, "cart": cart.get(username)})
 
 @app.route("/update_cart", methods=["POST"])
 def update_cart():
     data = request.json
     username = data.get('username')
     medicine = data.get('medicine')
-    quantity = data.get('quantity', 1)
     
     if not username:
         return jsonify({"success": False, "message": "User not authenticated"})
     
+    try:
+        # 0 removes the line
+        quantity = validate_quantity(data.get('quantity', 1), 0)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
     if not medicine or medicine not in medicines:
         return jsonify({"success": False, "message": "Medicine not found"})
     
-    if quantity <= 0:
-        if medicine in cart:
-            del cart[medicine]
-    else:
-        if medicines[medicine]['stock'] < quantity:
+    with cart.lock(username):
+        try:
+            reservations.hold(username, medicine, quantity)
+        except InsufficientStock:
             return jsonify({"success": False, "message": "Insufficient stock"})
-        cart[medicine] = quantity
+        cart.set(username, medicine, quantity)
     
-    save_data(medicines, users, orders, cart)
     return jsonify({"success": True, "message": "Cart updated"})
 
 @app.route("/remove_from_cart", methods=["POST"])
@@ -276,9 +436,14 @@ def remove_from_cart():
     if not username:
         return jsonify({"success": False, "message": "User not authenticated"})
     
-    if medicine in cart:
-        del cart[medicine]
-        save_data(medicines, users, orders, cart)
+    if not medicine or not isinstance(medicine, str):
+        return jsonify({"success": False, "message": "medicine must be a non-empty string"}), 400
+    
+    with cart.lock(username):
+        removed = cart.remove(username, medicine)
+        if removed:
+            reservations.release(username, medicine)
+    if removed:
         return jsonify({"success": True, "message": "Item removed from cart"})
     
     return jsonify({"success": False, "message": "Item not found in cart"})
@@ -293,36 +458,34 @@ def place_order():
     if not username:
         return jsonify({"success": False, "message": "User not authenticated"})
     
-    if not cart:
-        return jsonify({"success": False, "message": "Cart is empty"})
-    
     if not prescription:
         return jsonify({"success": False, "message": "Prescription details required"})
     
-    # Check stock availability
-    for med, qty in cart.items():
-        if medicines[med]['stock'] < qty:
-            return jsonify({"success": False, "message": f"Insufficient stock for {med}"})
-    
-    order_id = generate_order_id()
-    delivery_time = calculate_delivery_time()
-    total_cost = calculate_total_cost(cart, medicines)
-    
-    orders[order_id] = {
-        "username": username,
-        "items": cart.copy(),
-        "prescription": prescription,
-        "status": "Processing",
-        "delivery_time": delivery_time,
-        "total": total_cost
-    }
-    
-    # Update stock
-    for med, qty in cart.items():
-        medicines[med]['stock'] -= qty
-    
-    cart.clear()
-    save_data(medicines, users, orders, cart)
+    # Hold the user's cart lock so a concurrent cart edit can't slip in between check and clear
+    with cart.lock(username):
+        items = cart.get(username)
+        if not items:
+            return jsonify({"success": False, "message": "Cart is empty"})
+        
+        delivery_time = calculate_delivery_time()
+        total_cost = calculate_total_cost(items, medicines)
+        order = {
+            "username": username,
+            "items": items,
+            "prescription": prescription,
+            "status": "Processing",
+            "delivery_time": delivery_time,
+            "total": total_cost
+        }
+        
+        try:
+            order_id = place_cart_order(username, order)
+        except InsufficientStock as e:
+            return jsonify({"success": False, "message": str(e)})
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        except sqlite3.IntegrityError:
+            return jsonify({"success": False, "message": "Could not place the order, please try again"}), 500
     
     return jsonify({
         "success": True,
@@ -338,16 +501,83 @@ def get_orders():
     if not username:
         return jsonify({"success": False, "message": "User not authenticated"})
     
-    user_orders = []
-    for order_id, order in orders.items():
-        if order['username'] == username:
-            order_data = order.copy()
-            order_data['order_id'] = order_id
-            if isinstance(order_data['delivery_time'], datetime):
-                order_data['delivery_time'] = order_data['delivery_time'].strftime('%Y-%m-%d %H:%M:%S')
-            user_orders.append(order_data)
-    
-    return jsonify({"success": True, "orders": user_orders})
+    return _list_orders(username=username)
+
+# Upper bound for ?limit= on order listings
+MAX_ORDERS_PAGE = 500
+
+def _serialize_order(order_id, order, totals):
+    # ``totals`` comes from order_totals(); an order not written yet keeps the total it was placed with
+    order_data = order.copy()
+    order_data['order_id'] = order_id
+    if order_id in totals:
+        order_data['total'] = totals[order_id]
+    elif 'total' not in order_data:
+        order_data['total'] = calculate_total_cost(order_data['items'], medicines)
+    if isinstance(order_data['delivery_time'], datetime):
+        order_data['delivery_time'] = order_data['delivery_time'].strftime('%Y-%m-%d %H:%M:%S')
+    created_at = id_time(order_id)
+    if created_at is not None:
+        order_data['created_at'] = created_at.strftime('%Y-%m-%d %H:%M:%S')
+    return order_data
+
+def _parse_order_date(value, end_of_day=False):
+    # Accept 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'; a bare 'until' date includes that whole day
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        day = datetime.strptime(value, '%Y-%m-%d')
+        return day + timedelta(days=1) if end_of_day else day
+
+def _list_orders(username=None):
+    """Shared listing for /get_orders and /admin_orders.
+
+    Supports ?status=, ?since=/?until= (delivery date range),
+    ?created_since=/?created_until= (when the order was placed), keyset paging
+    with ?after=<order_id>&limit=N (default and at most MAX_ORDERS_PAGE;
+    a full page carries next_after), and ?format=ndjson to stream every
+    matching order as newline-delimited JSON. ?archived=1 lists archived
+    orders instead of current ones.
+    """
+    args = request.args
+    try:
+        since = _parse_order_date(args.get('since'))
+        until = _parse_order_date(args.get('until'), end_of_day=True)
+        created_since = _parse_order_date(args.get('created_since'))
+        created_until = _parse_order_date(args.get('created_until'), end_of_day=True)
+        limit = int(args['limit']) if args.get('limit') else None
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid date or limit"}), 400
+    status = args.get('status') or None
+    source = order_archive if args.get('archived') in ('1', 'true') else orders
+
+    if args.get('format') == 'ndjson':
+        def generate():
+            batch = []
+            for item in source.iter_pages(username, status, since, until,
+                                          created_since=created_since, created_until=created_until):
+                batch.append(item)
+                if len(batch) == MAX_ORDERS_PAGE:
+                    yield from _serialize_batch(batch)
+                    batch = []
+            yield from _serialize_batch(batch)
+
+        def _serialize_batch(batch):
+            totals = order_totals(oid for oid, _ in batch)
+            for order_id, order in batch:
+                yield json.dumps(_serialize_order(order_id, order, totals)) + "\n"
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    limit = MAX_ORDERS_PAGE if limit is None else max(1, min(limit, MAX_ORDERS_PAGE))
+    page = source.page(username, status, since, until, after=args.get('after') or None, limit=limit,
+                       created_since=created_since, created_until=created_until)
+    totals = order_totals(oid for oid, _ in page)
+    body = {"success": True, "orders": [_serialize_order(oid, order, totals) for oid, order in page]}
+    if len(page) == limit:
+        body["next_after"] = page[-1][0]
+    return jsonify(body)
 
 @app.route("/cancel_order", methods=["POST"])
 def cancel_order():
@@ -358,10 +588,13 @@ def cancel_order():
     if not username:
         return jsonify({"success": False, "message": "User not authenticated"})
     
-    if order_id not in orders:
-        return jsonify({"success": False, "message": "Order not found"})
+    order = orders.get(order_id)
+    if order is None:
+        # Archived orders are Delivered, so they exist but can't be cancelled
+        order = order_archive.get(order_id)
+        if order is None:
+            return jsonify({"success": False, "message": "Order not found"})
     
-    order = orders[order_id]
     if order['username'] != username:
         return jsonify({"success": False, "message": "Unauthorized"})
     
@@ -380,13 +613,9 @@ def cancel_order():
     if current_time >= cutoff_time:
         return jsonify({"success": False, "message": "Too close to delivery time! Cancellation not allowed."})
     
-    # Restore stock
-    for med, qty in order['items'].items():
-        if med in medicines:
-            medicines[med]['stock'] += qty
-    
-    del orders[order_id]
-    save_data(medicines, users, orders, cart)
+    # The row is deleted and its stock returned in one transaction; only the cancel that deleted it restores stock
+    if reservations.cancel(order_id, username) is None:
+        return jsonify({"success": False, "message": "Order cannot be cancelled"})
     
     return jsonify({"success": True, "message": "Order cancelled successfully"})
 
@@ -427,18 +656,42 @@ def admin_remove_medicine():
     save_data(medicines, users, orders, cart)
     return jsonify({'success': True})
 
+@app.route('/admin_catalog/import', methods=['POST'])
+def admin_catalog_import():
+    # Streams a CSV or JSONL upload (multipart "file" field or the raw body) into the catalog
+    if not is_admin():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, fmt = upload.stream, guess_format(upload.filename, upload.content_type)
+    else:
+        stream, fmt = request.stream, guess_format(content_type=request.content_type)
+    fmt = request.args.get('format') or fmt
+    if fmt not in CATALOG_FORMATS:
+        return jsonify({'success': False, 'message': 'Pass ?format=csv or ?format=jsonl'}), 400
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        report = import_catalog(lines, fmt, dry_run=request.args.get('dry_run') in ('1', 'true'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(dict(report, success=True))
+
+@app.route('/admin_catalog/export', methods=['GET'])
+def admin_catalog_export():
+    if not is_admin():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    fmt = request.args.get('format', 'csv')
+    if fmt not in CATALOG_FORMATS:
+        return jsonify({'success': False, 'message': 'Pass ?format=csv or ?format=jsonl'}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(export_catalog(fmt), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=medicines.{fmt}'})
+
 @app.route('/admin_orders', methods=['GET'])
 def admin_orders():
     if not is_admin():
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
-    all_orders = []
-    for oid, order in orders.items():
-        order_data = order.copy()
-        order_data['order_id'] = oid
-        if isinstance(order_data['delivery_time'], datetime):
-            order_data['delivery_time'] = order_data['delivery_time'].strftime('%Y-%m-%d %H:%M:%S')
-        all_orders.append(order_data)
-    return jsonify({'success': True, 'orders': all_orders})
+    return _list_orders()
 
 @app.route('/admin_update_order', methods=['POST'])
 def admin_update_order():
@@ -447,14 +700,117 @@ def admin_update_order():
     data = request.json
     order_id = data.get('order_id', '').strip()
     status = data.get('status', '').strip()
-    if order_id not in orders:
-        return jsonify({'success': False, 'message': 'Order not found'}), 404
     if status not in ['Processing', 'Shipped', 'Delivered']:
         return jsonify({'success': False, 'message': 'Invalid status'}), 400
+    if order_id not in orders and order_archive.restore(order_id) is None:
+        return jsonify({'success': False, 'message': 'Order not found'}), 404
     orders[order_id]['status'] = status
     save_data(medicines, users, orders, cart)
     return jsonify({'success': True})
 
+@app.route('/admin_orders/archive', methods=['GET', 'POST'])
+def admin_archive_orders():
+    # GET: archive size and the last background run; POST: archive old Delivered orders now
+    if not is_admin():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    if request.method == 'GET':
+        return jsonify(dict(order_archive.stats(), success=True))
+    data = request.get_json(silent=True) or {}
+    try:
+        days = float(data.get('older_than_days', ARCHIVE_AFTER_DAYS))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid older_than_days'}), 400
+    moved = order_archive.archive_delivered(days)
+    return jsonify(dict(order_archive.stats(), moved=moved, success=True))
+
+# --- Admin profiling: cProfile/sampling for the next N requests to a route, tracemalloc snapshots ---
+def _profiling_denied():
+    if not PROFILING_ENABLED:
+        return jsonify({'success': False, 'message': 'Profiling is disabled'}), 404
+    if not is_admin():
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    return None
+
+def _profile_endpoint(target):
+    # Accept an endpoint name or a URL rule such as /get_orders
+    if target in app.view_functions:
+        return target
+    for rule in app.url_map.iter_rules():
+        if rule.rule == target and rule.methods - {'OPTIONS', 'HEAD'}:
+            return rule.endpoint
+    return None
+
+@app.route('/admin_profile', methods=['GET', 'POST'])
+def admin_profile():
+    denied = _profiling_denied()
+    if denied:
+        return denied
+    if request.method == 'GET':
+        try:
+            limit = int(request.args.get('limit', 40))
+            return jsonify(dict(route_profiler.report(request.args.get('sort', 'cumulative'), limit), success=True))
+        except (KeyError, ValueError):
+            return jsonify({'success': False, 'message': 'Invalid sort or limit'}), 400
+    data = request.get_json(silent=True) or {}
+    endpoint = _profile_endpoint(data.get('route', ''))
+    if endpoint is None:
+        return jsonify({'success': False, 'message': 'Unknown route'}), 404
+    try:
+        status = route_profiler.start(app, endpoint, data.get('requests', 10), data.get('mode', 'cprofile'),
+                                      float(data.get('interval_ms', 5)) / 1000)
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(dict(status, success=True))
+
+@app.route('/admin_profile/stop', methods=['POST'])
+def admin_profile_stop():
+    denied = _profiling_denied()
+    if denied:
+        return denied
+    return jsonify(dict(route_profiler.stop(), success=True))
+
+def _collection_sizes():
+    return {"medicines": len(medicines), "users": len(users), "orders": orders.cache_stats()}
+
+@app.route('/admin_memory', methods=['GET'])
+def admin_memory():
+    denied = _profiling_denied()
+    if denied:
+        return denied
+    return jsonify(dict(memory_tracker.status(), collections=_collection_sizes(), success=True))
+
+@app.route('/admin_memory/<action>', methods=['POST'])
+def admin_memory_action(action):
+    denied = _profiling_denied()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    try:
+        if action == 'start':
+            result = memory_tracker.start(data.get('frames', 1))
+        elif action == 'stop':
+            result = memory_tracker.stop()
+        elif action == 'snapshot':
+            result = memory_tracker.snapshot(data.get('key', 'lineno'), int(data.get('limit', 20)))
+        else:
+            return jsonify({'success': False, 'message': 'Unknown action'}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(dict(result, collections=_collection_sizes(), success=True))
+
+@app.route('/admin_memory/diff', methods=['GET'])
+def admin_memory_diff():
+    denied = _profiling_denied()
+    if denied:
+        return denied
+    try:
+        result = memory_tracker.diff(int(request.args['from']), int(request.args['to']) if request.args.get('to') else None,
+                                     request.args.get('key', 'lineno'), int(request.args.get('limit', 20)))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(dict(result, success=True))
+
 if __name__ == "__main__":
+    init()
     app.run(host="0.0.0.0", port=5000, debug=True)
 
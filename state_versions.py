@@ -0,0 +1,103 @@
+import os
+import threading
+
+# Collections cached in memory by each process; writers bump the matching row
+COLLECTIONS = ("medicines", "users", "orders", "cart")
+# Versions of changed keys kept per collection; a process further behind reloads the whole collection
+CHANGE_LOG_VERSIONS = int(os.getenv("CHANGE_LOG_VERSIONS", "10000"))
+
+
+def init_versions_table(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS state_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    conn.executemany("INSERT OR IGNORE INTO state_versions (name, version) VALUES (?, 0)",
+                     [(name,) for name in COLLECTIONS])
+    conn.execute("CREATE TABLE IF NOT EXISTS state_changes (name TEXT NOT NULL, version INTEGER NOT NULL, key TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_state_changes ON state_changes (name, version)")
+    conn.commit()
+
+
+class VersionTracker:
+    """Tells a process which of its cached collections another process changed.
+
+    Every write bumps a row in ``state_versions`` inside the writer's own
+    transaction. ``changed()`` first asks a dedicated connection for
+    ``PRAGMA data_version``, which only moves when some other connection
+    has committed, so the common "nothing happened" case costs one pragma.
+    Only then is the version table read and compared with the versions this
+    process has already seen. Bumps made by this process are recorded with
+    ``written()`` after commit so they don't trigger a reload here.
+
+    Writers that know which rows they touched use ``bump_keys()``, which
+    also logs the keys in ``state_changes`` under the new version, so a
+    reader can refresh just those rows (``changed_keys()``) instead of the
+    whole collection.
+    """
+
+    def __init__(self, pool):
+        # No database access here; init_versions_table() and reset() run from data_storage.init()
+        self._pool = pool
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._seen = {}
+
+    def reset(self, conn):
+        """Take the current versions as seen (call right before loading the collections)."""
+        with self._lock:
+            self._seen = dict(conn.execute("SELECT name, version FROM state_versions").fetchall())
+
+    def bump(self, conn, *names):
+        """Increment the given rows in the caller's transaction; pass the result to written() after commit."""
+        return {name: conn.execute("UPDATE state_versions SET version = version + 1 WHERE name = ? RETURNING version",
+                                   (name,)).fetchone()[0] for name in names}
+
+    def bump_keys(self, conn, name, keys):
+        """bump() one collection and log which of its keys changed in that version."""
+        version = self.bump(conn, name)[name]
+        conn.executemany("INSERT INTO state_changes (name, version, key) VALUES (?, ?, ?)",
+                         [(name, version, key) for key in keys])
+        if version % 256 == 0:
+            conn.execute("DELETE FROM state_changes WHERE name = ? AND version <= ?",
+                         (name, version - CHANGE_LOG_VERSIONS))
+        return {name: version}
+
+    def changed_keys(self, conn, name, seen, current):
+        """Keys changed in versions (seen, current], or None if some version didn't log its keys."""
+        if seen is None or current - seen > CHANGE_LOG_VERSIONS:
+            return None
+        rows = conn.execute("SELECT version, key FROM state_changes WHERE name = ? AND version > ? AND version <= ?",
+                            (name, seen, current)).fetchall()
+        # Plain bump()s and pruned versions leave gaps
+        if len({version for version, _ in rows}) != current - seen:
+            return None
+        return {key for _, key in rows}
+
+    def written(self, bumped):
+        with self._lock:
+            for name, version in bumped.items():
+                # Only skip the reload if nobody else wrote in between
+                if self._seen.get(name) == version - 1:
+                    self._seen[name] = version
+
+    def changed(self):
+        """Return {collection: (version last seen, current version)} for collections that moved."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never share the watcher connection with a forked child
+                self._conn = self._pool.dedicated()
+                self._pid = os.getpid()
+                self._data_version = None
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return {}
+            self._data_version = data_version
+            rows = self._conn.execute("SELECT name, version FROM state_versions").fetchall()
+            changed = {name: (self._seen.get(name), version) for name, version in rows
+                       if self._seen.get(name) != version}
+            self._seen.update(rows)
+        return changed
+
+    def stats(self):
+        with self._lock:
+            return dict(self._seen)
@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The data layer opens DB_NAME when it is first imported; point it at a throw-away file
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="delivery-tests-"), "delivery.db")
+os.environ.update(DB_NAME=DB_PATH, WRITE_BEHIND_INTERVAL="0", JOB_AUTOSTART="0")
+
+
+@pytest.fixture
+def db():
+    """The initialized data layer module."""
+    import data_storage
+    data_storage.init()
+    return data_storage
+
+
+@pytest.fixture
+def stock_item(db):
+    """Add a medicine with 30 units for one test; yields its name."""
+    def add(name, stock=30):
+        with db.pool.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO medicines (name, price, stock) VALUES (?, 2.0, ?)", (name, stock))
+            conn.execute("DELETE FROM stock_holds WHERE medicine = ?", (name,))
+            conn.commit()
+        db.reload_catalog()
+        return name
+    return add
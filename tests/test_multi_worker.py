@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+from datetime import datetime
+
+
+def _worker(path, requests, replies):
+    # Another server process: same database, its own caches
+    os.environ["DB_NAME"] = path
+    import data_storage as db
+    from reservations import reservations, place_cart_order
+    db.init()
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        action, args = request
+        db.sync()
+        if action == "add_medicine":
+            name, stock = args
+            db.medicines[name] = {"price": 5.0, "stock": stock}
+            db.save_data(db.medicines, db.users, db.orders, db.cart)
+        elif action == "register":
+            db.users[args] = {"password": "secret1", "address": "1 Road"}
+            db.save_data(db.medicines, db.users, db.orders, db.cart)
+        elif action == "add_to_cart":
+            username, name, quantity = args
+            with db.cart.lock(username):
+                reservations.hold(username, name, db.cart.quantity(username, name) + quantity)
+                db.cart.add(username, name, quantity)
+        elif action == "place_order":
+            username = args
+            with db.cart.lock(username):
+                order = {"username": username, "items": db.cart.get(username), "prescription": "test",
+                         "status": "Processing", "delivery_time": datetime.now()}
+                replies.put(place_cart_order(username, order))
+                continue
+        elif action == "set_status":
+            order_id, status = args
+            db.orders[order_id]["status"] = status
+            db.save_data(db.medicines, db.users, db.orders, db.cart)
+        replies.put(None)
+
+
+class Worker:
+    def __init__(self, ctx, path):
+        self._requests, self._replies = ctx.Queue(), ctx.Queue()
+        self.process = ctx.Process(target=_worker, args=(path, self._requests, self._replies), daemon=True)
+        self.process.start()
+
+    def call(self, action, args):
+        self._requests.put((action, args))
+        return self._replies.get(timeout=60)
+
+    def stop(self):
+        self._requests.put(None)
+        self.process.join(30)
+
+
+def test_writes_in_another_process_reach_this_ones_caches(db):
+    worker = Worker(multiprocessing.get_context("spawn"), db.pool.path)
+    try:
+        worker.call("add_medicine", ("Multi Worker Med", 40))
+        db.sync()
+        assert db.medicines["Multi Worker Med"]["stock"] == 40
+
+        worker.call("register", "mw-pat")
+        db.sync()
+        assert db.users["mw-pat"]["address"] == "1 Road"
+
+        assert db.cart.get("mw-pat") == {}  # cached empty here before the other process writes
+        worker.call("add_to_cart", ("mw-pat", "Multi Worker Med", 3))
+        db.sync()
+        assert db.cart.get("mw-pat") == {"Multi Worker Med": 3}
+        assert db.medicines["Multi Worker Med"]["stock"] == 37
+
+        db.cart.get("mw-other")
+        order_id = worker.call("place_order", "mw-pat")
+        db.sync()
+        assert db.cart.get("mw-pat") == {}
+        assert "mw-other" in db.cart._carts  # only the changed user's cart was dropped
+        assert db.orders[order_id]["status"] == "Processing"
+
+        worker.call("set_status", (order_id, "Shipped"))
+        db.sync()
+        assert db.orders[order_id]["status"] == "Shipped"
+    finally:
+        worker.stop()
+
+
+def test_concurrent_orders_from_several_processes_agree_on_stock(db):
+    ctx = multiprocessing.get_context("spawn")
+    workers = [Worker(ctx, db.pool.path) for _ in range(3)]
+    try:
+        workers[0].call("add_medicine", ("Multi Worker Shared", 20))
+        for n, worker in enumerate(workers):
+            for i in range(4):
+                worker._requests.put(("add_to_cart", (f"mw-{n}-{i}", "Multi Worker Shared", 1)))
+                worker._requests.put(("place_order", f"mw-{n}-{i}"))
+        for worker in workers:
+            for _ in range(8):
+                worker._replies.get(timeout=60)
+        db.sync()
+        with db.pool.connection() as conn:
+            stock = conn.execute("SELECT stock FROM medicines WHERE name = 'Multi Worker Shared'").fetchone()[0]
+            ordered = conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM order_items "
+                                   "WHERE medicine = 'Multi Worker Shared'").fetchone()[0]
+        assert (stock, ordered) == (8, 12)
+        assert db.medicines["Multi Worker Shared"]["stock"] == 8
+    finally:
+        for worker in workers:
+            worker.stop()
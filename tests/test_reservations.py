@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from reservations import StockReservations, InsufficientStock
+
+THREADS = 12
+
+
+def _engine(db):
+    return StockReservations(db.pool, db.medicines, versions=db.versions, orders=db.orders)
+
+
+def _order(username, items):
+    return {"username": username, "items": items, "prescription": "test", "status": "Processing",
+            "delivery_time": datetime.now()}
+
+
+def _place(db, engine, username, items):
+    order = _order(username, items)
+    order_id, _ = db.place_with_fresh_id(lambda order_id: engine.reserve(
+        username, items, write=lambda conn: db.write_order(conn, order_id, order)))
+    return order_id
+
+
+def _run_threads(target):
+    threads = [threading.Thread(target=target, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def _stock(db, name):
+    with db.pool.connection() as conn:
+        return conn.execute("SELECT stock FROM medicines WHERE name = ?", (name,)).fetchone()[0]
+
+
+def _ordered(db, name):
+    with db.pool.connection() as conn:
+        return conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM order_items WHERE medicine = ?",
+                            (name,)).fetchone()[0]
+
+
+def _held(db, name):
+    with db.pool.connection() as conn:
+        return conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM stock_holds WHERE medicine = ?",
+                            (name,)).fetchone()[0]
+
+
+def test_concurrent_orders_never_oversell(db, stock_item):
+    name = stock_item("Oversell Test A", stock=30)
+    engine = _engine(db)
+    placed, rejected = [], []
+
+    def buy(n):
+        for i in range(3):
+            try:
+                placed.append(_place(db, engine, f"buyer-{n}-{i}", {name: 2}))
+            except InsufficientStock:
+                rejected.append(n)
+
+    _run_threads(buy)
+    assert len(placed) == 15
+    assert len(rejected) == THREADS * 3 - 15
+    assert _stock(db, name) == 0
+    assert _ordered(db, name) == 30
+    assert db.medicines[name]["stock"] == 0
+
+
+def test_concurrent_holds_account_for_every_unit(db, stock_item):
+    name = stock_item("Oversell Test B", stock=30)
+    engine = _engine(db)
+    done = []  # users whose line was released or ordered
+
+    def shop(n):
+        username = f"holder-{n}"
+        for quantity in (1, 4, 2):
+            try:
+                engine.hold(username, name, quantity)
+            except InsufficientStock:
+                pass
+        if n % 3 == 0:
+            engine.release(username, name)
+            done.append(username)
+        elif n % 3 == 1:
+            try:
+                _place(db, engine, username, {name: 2})
+                done.append(username)
+            except InsufficientStock:
+                pass
+
+    _run_threads(shop)
+    held_units = _held(db, name)
+    stock = _stock(db, name)
+    assert stock >= 0
+    assert stock + held_units + _ordered(db, name) == 30
+    # Released lines and placed orders leave no hold behind
+    with db.pool.connection() as conn:
+        holders = {row[0] for row in conn.execute("SELECT username FROM stock_holds WHERE medicine = ?", (name,))}
+    assert not holders & set(done)
+
+
+def _reserve_in_process(path, name, worker, results):
+    os.environ["DB_NAME"] = path
+    import data_storage as db
+    db.init()
+    engine = _engine(db)
+    placed = 0
+    for i in range(10):
+        try:
+            _place(db, engine, f"proc-{worker}-{i}", {name: 1})
+            placed += 1
+        except InsufficientStock:
+            pass
+    results.put(placed)
+
+
+def test_orders_from_several_processes_never_oversell(db, stock_item):
+    name = stock_item("Oversell Test C", stock=25)
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_reserve_in_process, args=(db.pool.path, name, n, results)) for n in range(4)]
+    for proc in procs:
+        proc.start()
+    placed = sum(results.get(timeout=60) for _ in procs)
+    for proc in procs:
+        proc.join(30)
+    assert placed == 25
+    conn = sqlite3.connect(db.pool.path)
+    try:
+        assert conn.execute("SELECT stock FROM medicines WHERE name = ?", (name,)).fetchone()[0] == 0
+    finally:
+        conn.close()
+    assert _ordered(db, name) == 25
@@ -1,6 +1,10 @@
-from data_storage import medicines, users, orders, cart, calculate_total_cost, generate_order_id, calculate_delivery_time, save_data
+from data_storage import medicines, users, orders, cart, calculate_total_cost, calculate_delivery_time, save_data
+from catalog_search import catalog_index
+from reservations import reservations, place_cart_order, InsufficientStock
+from order_archive import order_archive
 from getpass import getpass
 from datetime import datetime, timedelta
+import sqlite3
 import webbrowser
 import os
 
@@ -37,18 +41,17 @@ def login():
     return None
 
 def search_medicines():
-    query = input("Enter medicine name to search: ").lower()
+    query = input("Enter medicine name to search: ")
     found = False
-    for med in medicines:
-        if query in med.lower():
-            details = medicines[med]
-            inr_price = details['price']
-            print(f"{med}: ₹{inr_price}")
-            found = True
+    for med, _score in catalog_index.search(query, limit=50):
+        details = medicines[med]
+        inr_price = details['price']
+        print(f"{med}: ₹{inr_price}")
+        found = True
     if not found:
         print("No matching medicines found!")
 
-def add_to_cart():
+def add_to_cart(username):
     medicine = input("Enter medicine name to add to cart (e.g., Paracetamol, Ibuprofen, Amoxicillin): ")
     if medicine not in medicines:
         print("Medicine not found!")
@@ -58,11 +61,13 @@ def add_to_cart():
         if quantity <= 0:
             print("Quantity must be positive!")
             return
-        if medicines[medicine]["stock"] < quantity:
-            print(f"Only {medicines[medicine]['stock']} units available!")
-            return
-        cart[medicine] = cart.get(medicine, 0) + quantity
-        save_data(medicines, users, orders, cart)
+        with cart.lock(username):
+            try:
+                reservations.hold(username, medicine, cart.quantity(username, medicine) + quantity)
+            except InsufficientStock:
+                print(f"Only {medicines[medicine]['stock']} units available!")
+                return
+            cart.add(username, medicine, quantity)
         print(f"{quantity} {medicine} added to cart for ₹{medicines[medicine]['price'] * quantity}!")
     except ValueError:
         print("Invalid quantity!")
@@ -72,27 +77,31 @@ def upload_prescription():
     return prescription
 
 def place_order(username):
-    if not cart:
+    items = cart.get(username)
+    if not items:
         print("Cart is empty!")
         return
     prescription = upload_prescription()
-    order_id = generate_order_id()
     delivery_time = calculate_delivery_time()
-    orders[order_id] = {
+    order = {
         "username": username,
-        "items": cart.copy(),
+        "items": items,
         "prescription": prescription,
         "status": "Processing",
         "delivery_time": delivery_time
     }
-    for med, qty in cart.items():
-        medicines[med]["stock"] -= qty
-    save_data(medicines, users, orders, cart)
-    total_cost = calculate_total_cost(cart, medicines)
+    try:
+        order_id = place_cart_order(username, order)
+    except (InsufficientStock, ValueError) as e:
+        print(f"{e}!")
+        return
+    except sqlite3.IntegrityError:
+        print("Could not place the order, please try again!")
+        return
+    total_cost = calculate_total_cost(items, medicines)
     print(f"Order placed! Order ID: {order_id}")
     print(f"Total Cost (including ₹417.5 delivery): ₹{total_cost}")
     print(f"Estimated Delivery: {delivery_time.strftime('%Y-%m-%d %H:%M:%S')}")
-    cart.clear()
 
 def cancel_order():
     order_id = input("Enter order ID to cancel: ")
@@ -105,33 +114,38 @@ def cancel_order():
             cutoff_time = delivery_time - time_limit
             
             if current_time < cutoff_time:
-                del orders[order_id]
-                save_data(medicines, users, orders, cart)
-                print(f"Order {order_id} cancelled!")
+                if reservations.cancel(order_id) is None:
+                    print("Order cannot be cancelled!")
+                else:
+                    print(f"Order {order_id} cancelled!")
             else:
                 print("Too close to delivery time! Cancellation not allowed.")
         else:
             print("Order not found or cannot be cancelled (already shipped/delivered)!")
+    elif order_archive.get(order_id) is not None:
+        print("Order not found or cannot be cancelled (already shipped/delivered)!")
     else:
         print("Order not found!")
 
 def date_of_arrival():
     order_id = input("Enter order ID: ")
-    if order_id in orders:
-        delivery_time = orders[order_id]["delivery_time"]
+    order = orders.get(order_id) or order_archive.get(order_id)
+    if order is not None:
+        delivery_time = order["delivery_time"]
         print(f"Order ID: {order_id}")
         print(f"Date of Arrival: {delivery_time.strftime('%Y-%m-%d %H:%M:%S')}")
     else:
         print("Order not found!")
 
-def view_cart():
+def view_cart(username):
     # Display the contents of the user's cart
-    if not cart:
+    items = cart.get(username)
+    if not items:
         print("Your cart is empty!")
         return
     print("\n=== Your Cart ===")
     total = 0
-    for medicine, quantity in cart.items():
+    for medicine, quantity in items.items():
         price = medicines[medicine]["price"]
         item_total = price * quantity
         total += item_total